@@ -0,0 +1,169 @@
+"""
+Audit da riga di comando di un file di predizioni, etichette e feature sensibili.
+
+Il file può essere un CSV, un archivio .npz oppure una cartella con un file <colonna>.npy per
+colonna (aperti in memory-map). Vengono calcolati i riepiloghi richiesti e, opzionalmente, uno
+sweep di epsilon; i risultati sono scritti in JSON. Pensato per molti job brevi: numpy, pandas,
+pyarrow e i pool di processi sono importati solo quando una funzionalità richiesta li usa.
+
+Esempio:
+    python audit_cli.py preds.csv --sensitive-column sex race --summaries fairness evaluation
+    python audit_cli.py run_dir/ --sweep laplace:categorical --epsilons 0.5 1 2 --seed 0 --output out.json
+"""
+import argparse
+import json
+import math
+import sys
+
+SUMMARIES = ("fairness", "evaluation", "fairness_accuracy", "intervals")
+
+
+def load_columns(path, columns):
+    """
+    Legge le colonne richieste da un CSV, da un archivio .npz o da una cartella di file .npy.
+
+    :param path: percorso del file o della cartella
+    :param columns: nomi delle colonne da leggere
+    :return: dizionario colonna -> array
+    """
+    import os
+    from utilities import Utilities
+
+    if os.path.isdir(path):
+        return {column: Utilities.load_array(os.path.join(path, column + '.npy')) for column in columns}
+    if path.endswith('.npz'):
+        import numpy as np
+        with np.load(path, allow_pickle=False) as archive:
+            return {column: archive[column] for column in columns}
+    # Import locale: pandas serve solo per i CSV
+    import pandas as pd
+    frame = pd.read_csv(path, usecols=list(dict.fromkeys(columns)))
+    return {column: frame[column].to_numpy() for column in columns}
+
+
+def to_json(value):
+    """Converte i risultati (dizionari con chiavi tuple, valori numpy, NaN) in tipi JSON standard."""
+    if isinstance(value, dict):
+        return {_json_key(key): to_json(item) for key, item in value.items()}
+    if isinstance(value, (list, tuple)):
+        return [to_json(item) for item in value]
+    if hasattr(value, 'tolist'):
+        return to_json(value.tolist())
+    if isinstance(value, float) and not math.isfinite(value):
+        return None
+    return value
+
+
+def _json_key(key):
+    if isinstance(key, tuple):
+        # Coppie di gruppi intersezionali: "a,b|c,d"
+        separator = "|" if any(isinstance(part, tuple) for part in key) else ","
+        return separator.join(_json_key(part) for part in key)
+    if hasattr(key, 'item'):
+        key = key.item()
+    return key if isinstance(key, str) else str(key)
+
+
+def _parse_sweep(value):
+    noise_type, _, data_type = value.partition(":")
+    if noise_type not in ("laplace", "gaussian") or data_type not in ("categorical", "quantitative"):
+        raise argparse.ArgumentTypeError("expected NOISE:DATA_TYPE, e.g. laplace:categorical")
+    return noise_type, data_type
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("input", help="file CSV, archivio .npz o cartella di file <colonna>.npy")
+    parser.add_argument("--prediction-column", default="predictions")
+    parser.add_argument("--label-column", default="labels")
+    parser.add_argument("--sensitive-column", nargs="+", default=["sensitive_features"],
+                        help="una o più colonne sensibili (più colonne: gruppi intersezionali)")
+    parser.add_argument("--summaries", nargs="*", choices=SUMMARIES, default=["fairness", "evaluation"])
+    parser.add_argument("--n-resamples", type=int, default=1000, help="ricampionamenti per 'intervals'")
+    parser.add_argument("--sweep", type=_parse_sweep, action="append", default=[], metavar="NOISE:DATA_TYPE",
+                        help="sweep di epsilon da eseguire (ripetibile)")
+    parser.add_argument("--epsilons", nargs="+", type=float, help="valori di epsilon (default: griglia del toolkit)")
+    parser.add_argument("--delta", type=float, default=0.1)
+    parser.add_argument("--seed", type=int)
+    parser.add_argument("--trials", type=int, default=1)
+    parser.add_argument("--mode", choices=("sampled", "analytic"), default="sampled")
+    parser.add_argument("--n-jobs", type=int, default=1,
+                        help="processi tra cui distribuire i punti degli sweep (-1: tutti i core)")
+    parser.add_argument("--row-jobs", type=int, default=1,
+                        help="processi tra cui suddividere le righe dei conteggi (-1: tutti i core)")
+    parser.add_argument("--min-support", type=int, default=0)
+    parser.add_argument("--store", help="cartella di un ResultsStore a cui aggiungere le righe degli sweep")
+    parser.add_argument("--model", default="", help="nome del modello registrato nello store")
+    parser.add_argument("--dataset", default="", help="nome del dataset registrato nello store")
+    parser.add_argument("--profile", action="store_true", help="include tempi e memoria di ogni fase")
+    parser.add_argument("--output", help="file JSON dei risultati (default: stdout)")
+    return parser
+
+
+def run(args):
+    """
+    Esegue l'audit descritto dagli argomenti.
+
+    :param args: argomenti letti da build_parser()
+    :return: dizionario dei risultati, già convertito in tipi JSON
+    """
+    from encoded_dataset import EncodedDataset
+    from privacy_fairness_toolkit import Toolkit
+
+    columns = load_columns(args.input, [args.prediction_column, args.label_column, *args.sensitive_column])
+    sensitive = [columns[column] for column in args.sensitive_column]
+    if len(sensitive) > 1:
+        import numpy as np
+        sensitive = np.column_stack(sensitive)
+    else:
+        sensitive = sensitive[0]
+
+    instrumentation = None
+    if args.profile:
+        from instrumentation import Instrumentation
+        instrumentation = Instrumentation(track_memory=True)
+    dataset = EncodedDataset(columns[args.label_column], sensitive)
+    toolkit = Toolkit.from_dataset(columns[args.prediction_column], dataset, args.min_support,
+                                   instrumentation=instrumentation, n_jobs=args.row_jobs)
+
+    results = {}
+    if "fairness" in args.summaries:
+        results["fairness_metrics"] = toolkit.summary_fairness_metrics(verbose=False)
+    if "evaluation" in args.summaries:
+        results["evaluation_metrics"] = toolkit.summary_evaluation_metrics(verbose=False)
+    if "fairness_accuracy" in args.summaries:
+        results["fairness_accuracy"] = toolkit.summary_fairness_accuracy(verbose=False)
+    if "intervals" in args.summaries:
+        results["fairness_intervals"] = toolkit.summary_fairness_intervals(args.n_resamples, seed=args.seed,
+                                                                           verbose=False)
+
+    store = None
+    if args.store and args.sweep:
+        from results_store import ResultsStore
+        store = ResultsStore(args.store)
+    for noise_type, data_type in args.sweep:
+        results.setdefault("tradeoff", {})[f"{noise_type}:{data_type}"] = toolkit.evaluate_tradeoff_accuracy_fairness(
+            noise_type, data_type, args.delta, args.epsilons, seed=args.seed, n_jobs=args.n_jobs,
+            n_trials=args.trials, store=store, model_name=args.model, dataset_name=args.dataset, verbose=False,
+            mode=args.mode)
+
+    if instrumentation is not None:
+        results["profile"] = instrumentation.report()
+    return to_json(results)
+
+
+def main(argv=None):
+    args = build_parser().parse_args(argv)
+    results = run(args)
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=2)
+            f.write("\n")
+    else:
+        json.dump(results, sys.stdout, indent=2)
+        sys.stdout.write("\n")
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -0,0 +1,71 @@
+import pandas as pd
+from differential_privacy import DifferentialPrivacy
+from metrics_accumulator import MetricsAccumulator
+
+# Numero di righe lette per ogni blocco del CSV
+DEFAULT_CHUNKSIZE = 100_000
+
+
+def _compact_dtypes(prediction_column, label_column, sensitive_columns, data_type):
+    """Tipi compatti di default: interi a 8 bit per esiti categorici, float32 per predizioni continue."""
+    dtype = {
+        prediction_column: 'int8' if data_type == 'categorical' else 'float32',
+        label_column: 'int8',
+    }
+    dtype.update({column: 'category' for column in sensitive_columns})
+    return dtype
+
+
+def _apply_noise(dp, predictions, noise_type, data_type, categories):
+    if noise_type == 'laplace' and data_type == 'categorical':
+        return dp.add_laplace_categorical_noise(predictions, categories=categories)
+    elif noise_type == 'laplace' and data_type == 'quantitative':
+        return dp.add_laplace_noise(predictions)
+    elif noise_type == 'gaussian' and data_type == 'categorical':
+        return dp.add_gaussian_categorical_noise(predictions, categories=categories)
+    elif noise_type == 'gaussian' and data_type == 'quantitative':
+        return dp.add_gaussian_noise(predictions)
+    else:
+        raise ValueError("Invalid combination of noise_type and data_type")
+
+
+def audit_csv(path, prediction_column, label_column, sensitive_column, chunksize=DEFAULT_CHUNKSIZE,
+              noise_type=None, data_type='categorical', epsilon=None, delta=0.1, categories=(0, 1),
+              seed=None, dtype=None):
+    """
+    Calcola metriche di fairness e accuratezza su un CSV di predizioni leggendolo a blocchi.
+
+    Vengono lette solo le colonne necessarie, con tipi compatti, e ogni blocco viene
+    aggregato in un MetricsAccumulator: la memoria usata non dipende dalla dimensione del file.
+
+    :param path: percorso del file CSV
+    :param prediction_column: colonna con le predizioni del modello
+    :param label_column: colonna con le etichette reali
+    :param sensitive_column: colonna con la feature sensibile, oppure lista di colonne per
+                             calcolare le metriche sulle loro intersezioni
+    :param chunksize: numero di righe per blocco
+    :param noise_type: se specificato ('laplace' o 'gaussian') applica la privacy differenziale
+                       alle predizioni di ogni blocco
+    :param data_type: tipo di dato delle predizioni ('categorical' o 'quantitative')
+    :param epsilon: valore epsilon per la privacy differenziale
+    :param delta: valore delta per la privacy differenziale
+    :param categories: categorie possibili delle predizioni, comuni a tutti i blocchi
+    :param seed: seed per rendere riproducibile il rumore
+    :param dtype: tipi delle colonne da usare al posto di quelli compatti di default
+    :return: MetricsAccumulator con i conteggi dell'intero file
+    """
+    if noise_type is not None and epsilon is None:
+        raise ValueError("epsilon is required when noise_type is given")
+    sensitive_columns = [sensitive_column] if isinstance(sensitive_column, str) else list(sensitive_column)
+    columns = [prediction_column, label_column] + sensitive_columns
+    if dtype is None:
+        dtype = _compact_dtypes(prediction_column, label_column, sensitive_columns, data_type)
+
+    accumulator = MetricsAccumulator()
+    dp = DifferentialPrivacy(epsilon, delta, seed) if noise_type is not None else None
+    for chunk in pd.read_csv(path, usecols=columns, dtype=dtype, chunksize=chunksize):
+        predictions = chunk[prediction_column].to_numpy()
+        if dp is not None:
+            predictions = _apply_noise(dp, predictions, noise_type, data_type, categories)
+        accumulator.update(predictions, chunk[label_column].to_numpy(), chunk[sensitive_columns])
+    return accumulator
@@ -0,0 +1,286 @@
+"""
+Servizio di audit residente: mantiene in memoria i dataset registrati, già codificati, e risponde
+a richieste HTTP/JSON locali con metriche di fairness, accuratezza e sweep di epsilon.
+
+Ogni richiesta crea solo un Toolkit sulle predizioni ricevute (EncodedDataset condiviso); il lavoro
+numerico gira su un pool di worker, così che l'event loop continui ad accettare richieste.
+
+Endpoint:
+    GET    /datasets                           elenco dei dataset registrati
+    POST   /datasets/<nome>                    {"labels": [...], "sensitive_features": [...]}
+                                               oppure {"path": cartella o file, colonne come in audit_cli}
+    DELETE /datasets/<nome>
+    POST   /datasets/<nome>/fairness           {"predictions": [...], "min_support": 0}
+    POST   /datasets/<nome>/accuracy           {"predictions": [...]}
+    POST   /datasets/<nome>/fairness_accuracy  {"predictions": [...]}
+    POST   /datasets/<nome>/sweep              {"predictions": [...], "noise_type": "laplace",
+                                                "data_type": "categorical", "epsilons": [...], "delta": 0.1,
+                                                "seed": 0, "trials": 1, "mode": "sampled"}
+
+Per vettori grandi le predizioni possono essere inviate come file .npy nel corpo, con
+Content-Type: application/x-npy, e gli altri parametri nella query string
+(es. /datasets/adult/sweep?epsilons=[0.5,1]&seed=0): il corpo JSON è limitato a MAX_JSON_BYTES
+perché le liste Python occupano molte volte la dimensione del testo.
+
+Esempio:
+    python audit_service.py --port 8765 --register adult=adult_test/
+    curl -X POST localhost:8765/datasets/adult/fairness -d '{"predictions": [0, 1, ...]}'
+    curl -X POST localhost:8765/datasets/adult/fairness -H 'Content-Type: application/x-npy' --data-binary @preds.npy
+"""
+import argparse
+import asyncio
+import io
+import json
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from http import HTTPStatus
+from urllib.parse import parse_qsl, urlsplit
+import numpy as np
+from audit_cli import load_columns, to_json
+from encoded_dataset import EncodedDataset
+from privacy_fairness_toolkit import Toolkit
+
+# Dimensione massima di un corpo JSON
+MAX_JSON_BYTES = 32 * 1024 ** 2
+# Dimensione massima di un corpo .npy (l'array occupa in memoria quanto il corpo)
+MAX_NPY_BYTES = 1 << 30
+NPY_CONTENT_TYPE = "application/x-npy"
+
+
+class HTTPError(Exception):
+    def __init__(self, status, message):
+        super().__init__(message)
+        self.status = status
+
+
+class AuditService:
+    def __init__(self, executor=None, max_workers=None):
+        """
+        Servizio di audit con dataset residenti.
+
+        :param executor: ThreadPoolExecutor su cui eseguire il calcolo delle metriche (default: nuovo
+                         pool); deve essere basato su thread, perché le richieste condividono i dataset
+                         residenti senza copiarli né serializzarli
+        :param max_workers: numero di thread del pool di default
+        """
+        if executor is not None and not isinstance(executor, ThreadPoolExecutor):
+            raise TypeError("executor must be a ThreadPoolExecutor: requests share the resident datasets")
+        self.datasets = {}
+        # Le richieste girano su più thread: letture e modifiche del registro avvengono sotto lock
+        self._lock = threading.Lock()
+        self.executor = executor or ThreadPoolExecutor(max_workers=max_workers)
+
+    def register(self, name, labels, sensitive_features):
+        """
+        Codifica e registra un dataset; sostituisce un eventuale dataset con lo stesso nome.
+
+        :param name: nome del dataset negli endpoint
+        :param labels: etichette reali (array o percorso .npy)
+        :param sensitive_features: feature sensibili (array, tabella n x m o percorso .npy)
+        :return: EncodedDataset registrato
+        """
+        dataset = EncodedDataset(labels, sensitive_features)
+        with self._lock:
+            self.datasets[name] = dataset
+        return dataset
+
+    def register_path(self, name, path, label_column="labels", sensitive_column=("sensitive_features",)):
+        """Registra un dataset letto da CSV, archivio .npz o cartella di file .npy (vedi audit_cli)."""
+        sensitive_column = [sensitive_column] if isinstance(sensitive_column, str) else list(sensitive_column)
+        columns = load_columns(path, [label_column, *sensitive_column])
+        sensitive = [columns[column] for column in sensitive_column]
+        return self.register(name, columns[label_column],
+                             np.column_stack(sensitive) if len(sensitive) > 1 else sensitive[0])
+
+    def _dataset(self, name):
+        with self._lock:
+            dataset = self.datasets.get(name)
+        if dataset is None:
+            raise HTTPError(HTTPStatus.NOT_FOUND, f"Unknown dataset {name!r}")
+        return dataset
+
+    def _describe(self, name, dataset):
+        return {"name": name, "rows": len(dataset), "groups": len(dataset.groups),
+                "classes": dataset.classes}
+
+    def _toolkit(self, name, payload):
+        if "predictions" not in payload:
+            raise HTTPError(HTTPStatus.BAD_REQUEST, "Missing 'predictions'")
+        return Toolkit.from_dataset(np.asarray(payload["predictions"]), self._dataset(name),
+                                    payload.get("min_support", 0))
+
+    def _register_payload(self, name, payload):
+        if "path" in payload:
+            dataset = self.register_path(name, payload["path"], payload.get("label_column", "labels"),
+                                         payload.get("sensitive_column", ("sensitive_features",)))
+        elif "labels" in payload and "sensitive_features" in payload:
+            dataset = self.register(name, np.asarray(payload["labels"]), np.asarray(payload["sensitive_features"]))
+        else:
+            raise HTTPError(HTTPStatus.BAD_REQUEST, "Expected 'path' or 'labels' and 'sensitive_features'")
+        return self._describe(name, dataset)
+
+    def _sweep(self, name, payload):
+        toolkit = self._toolkit(name, payload)
+        return toolkit.evaluate_tradeoff_accuracy_fairness(
+            payload.get("noise_type", "laplace"), payload.get("data_type", "categorical"),
+            payload.get("delta", 0.1), payload.get("epsilons"), seed=payload.get("seed"),
+            n_trials=payload.get("trials", 1), verbose=False, mode=payload.get("mode", "sampled"))
+
+    def handle_request(self, method, path, payload):
+        """
+        Esegue una richiesta in modo sincrono (nel pool di worker).
+
+        :param method: metodo HTTP
+        :param path: percorso della richiesta
+        :param payload: corpo JSON già decodificato
+        :return: risposta convertita in tipi JSON
+        """
+        parts = [part for part in urlsplit(path).path.split("/") if part]
+        if parts == ["datasets"] and method == "GET":
+            with self._lock:
+                datasets = list(self.datasets.items())
+            return to_json([self._describe(name, dataset) for name, dataset in datasets])
+        if len(parts) == 2 and parts[0] == "datasets":
+            if method == "POST":
+                return to_json(self._register_payload(parts[1], payload))
+            if method == "DELETE":
+                with self._lock:
+                    dataset = self.datasets.pop(parts[1], None)
+                if dataset is None:
+                    raise HTTPError(HTTPStatus.NOT_FOUND, f"Unknown dataset {parts[1]!r}")
+                return {"deleted": parts[1]}
+            if method == "GET":
+                return to_json(self._describe(parts[1], self._dataset(parts[1])))
+        if len(parts) == 3 and parts[0] == "datasets" and method == "POST":
+            name, query = parts[1], parts[2]
+            if query == "fairness":
+                return to_json(self._toolkit(name, payload).summary_fairness_metrics(verbose=False))
+            if query == "accuracy":
+                return to_json(self._toolkit(name, payload).summary_evaluation_metrics(verbose=False))
+            if query == "fairness_accuracy":
+                return to_json(self._toolkit(name, payload).summary_fairness_accuracy(verbose=False))
+            if query == "sweep":
+                return to_json(self._sweep(name, payload))
+        raise HTTPError(HTTPStatus.NOT_FOUND, f"No endpoint for {method} {path}")
+
+    def handle_body(self, method, path, body, content_type):
+        """
+        Decodifica il corpo (JSON oppure .npy con i parametri nella query string) ed esegue la
+        richiesta; viene chiamato nel pool di worker, così il parsing non blocca l'event loop.
+        """
+        if content_type == NPY_CONTENT_TYPE:
+            payload = {}
+            for key, value in parse_qsl(urlsplit(path).query):
+                try:
+                    payload[key] = json.loads(value)
+                except ValueError:
+                    payload[key] = value
+            payload["predictions"] = np.load(io.BytesIO(body), allow_pickle=False)
+        else:
+            payload = json.loads(body) if body else {}
+            if not isinstance(payload, dict):
+                raise HTTPError(HTTPStatus.BAD_REQUEST, "Request body must be a JSON object")
+        return self.handle_request(method, path, payload)
+
+    async def _read_request(self, reader):
+        request_line = await reader.readline()
+        if not request_line:
+            return None
+        try:
+            method, path, version = request_line.decode("latin-1").split()
+        except ValueError:
+            raise HTTPError(HTTPStatus.BAD_REQUEST, "Malformed request line") from None
+        headers = {}
+        while True:
+            line = await reader.readline()
+            if line in (b"\r\n", b"\n", b""):
+                break
+            key, _, value = line.decode("latin-1").partition(":")
+            headers[key.strip().lower()] = value.strip()
+        length = int(headers.get("content-length", 0))
+        content_type = headers.get("content-type", "").split(";")[0].strip().lower()
+        if length > (MAX_NPY_BYTES if content_type == NPY_CONTENT_TYPE else MAX_JSON_BYTES):
+            # Il corpo non viene letto: la connessione va chiusa dopo la risposta
+            raise HTTPError(HTTPStatus.REQUEST_ENTITY_TOO_LARGE, "Request body too large")
+        body = await reader.readexactly(length) if length else b""
+        keep_alive = headers.get("connection", "").lower() != "close" and version == "HTTP/1.1"
+        return method, path, body, content_type, keep_alive
+
+    async def _write_response(self, writer, status, content, keep_alive):
+        body = json.dumps(content).encode()
+        writer.write(f"HTTP/1.1 {status.value} {status.phrase}\r\n"
+                     f"Content-Type: application/json\r\nContent-Length: {len(body)}\r\n"
+                     f"Connection: {'keep-alive' if keep_alive else 'close'}\r\n\r\n".encode() + body)
+        await writer.drain()
+
+    async def handle_connection(self, reader, writer):
+        """Serve le richieste di una connessione (con keep-alive) finché il client non la chiude."""
+        loop = asyncio.get_running_loop()
+        try:
+            while True:
+                keep_alive = False
+                try:
+                    request = await self._read_request(reader)
+                    if request is None:
+                        break
+                    method, path, body, content_type, keep_alive = request
+                    result = await loop.run_in_executor(self.executor, self.handle_body, method, path, body,
+                                                        content_type)
+                    status, content = HTTPStatus.OK, result
+                except HTTPError as error:
+                    status, content = error.status, {"error": str(error)}
+                except (ValueError, TypeError, KeyError) as error:
+                    status, content = HTTPStatus.BAD_REQUEST, {"error": str(error)}
+                except asyncio.IncompleteReadError:
+                    break
+                except Exception as error:
+                    status, content = HTTPStatus.INTERNAL_SERVER_ERROR, {"error": repr(error)}
+                await self._write_response(writer, status, content, keep_alive)
+                if not keep_alive:
+                    break
+        except ConnectionError:
+            pass
+        finally:
+            writer.close()
+
+    async def serve(self, host="127.0.0.1", port=8765):
+        """
+        Avvia il server; usare `async with await service.serve(...)` oppure serve_forever().
+
+        :return: asyncio.Server in ascolto
+        """
+        return await asyncio.start_server(self.handle_connection, host, port)
+
+
+async def _serve_forever(service, host, port):
+    server = await service.serve(host, port)
+    addresses = ", ".join(str(socket.getsockname()) for socket in server.sockets)
+    print(f"Serving audits on {addresses}", flush=True)
+    async with server:
+        await server.serve_forever()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--workers", type=int, help="thread del pool di calcolo")
+    parser.add_argument("--register", action="append", default=[], metavar="NOME=PERCORSO",
+                        help="dataset da registrare all'avvio (ripetibile)")
+    parser.add_argument("--label-column", default="labels")
+    parser.add_argument("--sensitive-column", nargs="+", default=["sensitive_features"])
+    args = parser.parse_args(argv)
+
+    service = AuditService(max_workers=args.workers)
+    for entry in args.register:
+        name, _, path = entry.partition("=")
+        service.register_path(name, path, args.label_column, args.sensitive_column)
+    try:
+        asyncio.run(_serve_forever(service, args.host, args.port))
+    except KeyboardInterrupt:
+        pass
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -0,0 +1,169 @@
+"""
+Benchmark di scalabilità per metriche di fairness, meccanismi di rumore e sweep di epsilon.
+
+Per ogni dimensione n genera dati sintetici, misura tempo (minimo e mediana su più ripetizioni)
+e picco di memoria allocata (tracemalloc) di ogni operazione e scrive un record JSON per riga,
+così che i risultati di commit diversi possano essere confrontati con --compare.
+
+Esempio:
+    python benchmark.py --sizes 1e3 1e5 1e6 --groups 4 --output bench.jsonl
+    python benchmark.py --sizes 1e3 1e5 1e6 --compare bench.jsonl
+"""
+import argparse
+import contextlib
+import io
+import json
+import platform
+import statistics
+import subprocess
+import time
+import tracemalloc
+import numpy as np
+from differential_privacy import DifferentialPrivacy
+from fairness_metrics import METRIC_METHODS, FairnessMetrics
+from model_evaluator import ModelEvaluator
+from privacy_fairness_toolkit import Toolkit
+
+
+def make_synthetic(n, n_groups=2, positive_rate=0.3, n_categories=2, accuracy=0.8, seed=0):
+    """
+    Genera predizioni, etichette, gruppi e punteggi sintetici.
+
+    :param n: numero di righe
+    :param n_groups: numero di gruppi della feature sensibile
+    :param positive_rate: frazione di etichette positive (per n_categories > 2, della classe 1)
+    :param n_categories: numero di classi delle etichette e delle predizioni
+    :param accuracy: frazione di predizioni uguali all'etichetta
+    :param seed: seed del generatore
+    :return: dizionario con predictions, labels, groups e scores
+    """
+    rng = np.random.default_rng(seed)
+    if n_categories == 2:
+        labels = (rng.random(n) < positive_rate).astype(np.int64)
+    else:
+        others = (1 - positive_rate) / (n_categories - 1)
+        probabilities = np.full(n_categories, others)
+        probabilities[1] = positive_rate
+        labels = rng.choice(n_categories, size=n, p=probabilities)
+    wrong = rng.random(n) >= accuracy
+    predictions = np.where(wrong, rng.integers(0, n_categories, n), labels)
+    groups = rng.integers(0, n_groups, n)
+    scores = np.clip(0.5 * (labels == 1) + 0.5 * rng.random(n), 0, 1)
+    return {"predictions": predictions, "labels": labels, "groups": groups, "scores": scores}
+
+
+def measure(function, repeat):
+    """Esegue function più volte e restituisce tempi (minimo, mediana) e picco di memoria."""
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        function()
+        timings.append(time.perf_counter() - start)
+
+    # Misura separata della memoria: tracemalloc rallenta l'esecuzione
+    tracemalloc.start()
+    function()
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return {"time_min": min(timings), "time_median": statistics.median(timings), "peak_bytes": peak}
+
+
+def benchmark_cases(data, epsilon, sweep_epsilons):
+    """Restituisce le coppie (nome, funzione) da misurare sui dati sintetici."""
+    predictions, labels, groups = data["predictions"], data["labels"], data["groups"]
+    fm = FairnessMetrics(predictions, labels, groups)
+    dp = DifferentialPrivacy(epsilon, rng=0)
+    toolkit = Toolkit(predictions, labels, groups)
+
+    def sweep():
+        with contextlib.redirect_stdout(io.StringIO()):
+            toolkit.evaluate_tradeoff_accuracy_fairness('laplace', 'categorical', epsilon_values=sweep_epsilons, seed=0)
+
+    cases = [("FairnessMetrics.__init__", lambda: FairnessMetrics(predictions, labels, groups))]
+    cases += [(f"FairnessMetrics.{name}", getattr(fm, name)) for name in METRIC_METHODS]
+    cases += [
+        ("FairnessMetrics.bootstrap", lambda: fm.bootstrap(200, seed=0)),
+        ("FairnessMetrics.compute_threshold_curves", lambda: fm.compute_threshold_curves(data["scores"])),
+        ("FairnessMetrics.compute_calibration_by_group", lambda: fm.compute_calibration_by_group(data["scores"])),
+        ("DifferentialPrivacy.add_laplace_noise", lambda: dp.add_laplace_noise(data["scores"])),
+        ("DifferentialPrivacy.add_gaussian_noise", lambda: dp.add_gaussian_noise(data["scores"])),
+        ("DifferentialPrivacy.add_laplace_categorical_noise", lambda: dp.add_laplace_categorical_noise(predictions)),
+        ("DifferentialPrivacy.add_gaussian_categorical_noise", lambda: dp.add_gaussian_categorical_noise(predictions)),
+        ("ModelEvaluator.summary", lambda: ModelEvaluator(labels, predictions).summary()),
+        ("Toolkit.evaluate_tradeoff_accuracy_fairness", sweep),
+    ]
+    return cases
+
+
+def _git_commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "HEAD"], capture_output=True, text=True,
+                              check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def run(sizes, n_groups, positive_rate, n_categories, repeat, epsilon, sweep_epsilons, only=None):
+    """Esegue tutti i benchmark e restituisce la lista dei record."""
+    environment = {"commit": _git_commit(), "python": platform.python_version(), "numpy": np.__version__,
+                   "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S")}
+    records = []
+    for n in sizes:
+        data = make_synthetic(n, n_groups, positive_rate, n_categories)
+        for name, function in benchmark_cases(data, epsilon, sweep_epsilons):
+            if only and not any(pattern in name for pattern in only):
+                continue
+            record = {"benchmark": name, "n": n, "n_groups": n_groups, "positive_rate": positive_rate,
+                      "n_categories": n_categories, "repeat": repeat}
+            record.update(measure(function, repeat))
+            record.update(environment)
+            records.append(record)
+            print(f"{name:55s} n={n:>10d} {record['time_min'] * 1000:10.2f} ms "
+                  f"{record['peak_bytes'] / 1024 ** 2:9.1f} MiB")
+    return records
+
+
+def compare(records, baseline_path, tolerance):
+    """Confronta i tempi con un file di risultati precedente e segnala i peggioramenti."""
+    with open(baseline_path) as f:
+        baseline = [json.loads(line) for line in f if line.strip()]
+    key = lambda r: (r["benchmark"], r["n"], r["n_groups"], r["n_categories"])
+    previous = {key(r): r for r in baseline}
+    regressions = []
+    for record in records:
+        old = previous.get(key(record))
+        if old and record["time_min"] > old["time_min"] * (1 + tolerance):
+            regressions.append((record, old))
+            print(f"REGRESSION {record['benchmark']} n={record['n']}: "
+                  f"{old['time_min'] * 1000:.2f} ms -> {record['time_min'] * 1000:.2f} ms")
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sizes", nargs="+", type=float, default=[1e3, 1e4, 1e5, 1e6])
+    parser.add_argument("--groups", type=int, default=2)
+    parser.add_argument("--positive-rate", type=float, default=0.3)
+    parser.add_argument("--categories", type=int, default=2)
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--epsilon", type=float, default=1.0)
+    parser.add_argument("--sweep-epsilons", nargs="+", type=float, default=[0.1, 0.3, 0.7, 1.5, 2, 2.5, 3, 5, 7])
+    parser.add_argument("--only", nargs="+", help="esegue solo i benchmark il cui nome contiene uno dei valori")
+    parser.add_argument("--output", help="file JSON lines a cui aggiungere i risultati")
+    parser.add_argument("--compare", help="file JSON lines di riferimento per individuare regressioni")
+    parser.add_argument("--tolerance", type=float, default=0.25, help="rallentamento relativo tollerato")
+    args = parser.parse_args(argv)
+
+    records = run([int(n) for n in args.sizes], args.groups, args.positive_rate, args.categories,
+                  args.repeat, args.epsilon, args.sweep_epsilons, args.only)
+    if args.output:
+        with open(args.output, "a") as f:
+            for record in records:
+                f.write(json.dumps(record) + "\n")
+    if args.compare:
+        return 1 if compare(records, args.compare, args.tolerance) else 0
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
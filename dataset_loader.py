@@ -0,0 +1,114 @@
+import hashlib
+import json
+import os
+import numpy as np
+from utilities import Utilities
+
+# Cartella di default della cache dei dataset pre-elaborati
+DEFAULT_CACHE_DIR = '.dataset_cache'
+# Da incrementare quando cambia la pre-elaborazione, per invalidare le cache esistenti
+CACHE_VERSION = 1
+# Array prodotti dalla pre-elaborazione, salvati come <nome>.npy
+ARRAYS = ("X_train", "X_test", "y_train", "y_test", "sensitive_train", "sensitive_test")
+
+
+def file_digest(path, block_size=1 << 20):
+    """Restituisce lo SHA-256 del contenuto di un file, letto a blocchi."""
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(block_size), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def preprocess(path, target, sensitive_features, columns=None, missing_values=None, dummies=None,
+               label_encode_target=False, test_size=0.2, random_state=42):
+    """
+    Legge un CSV e produce le feature codificate e standardizzate, divise in train e test.
+
+    :param path: percorso del file CSV
+    :param target: colonna della variabile target (dopo la codifica se dummies='frame')
+    :param sensitive_features: lista delle colonne sensibili, escluse dalle feature
+    :param columns: colonne da usare (default: tutte)
+    :param missing_values: valori da trattare come mancanti oltre ai NaN (es. ' ?')
+    :param dummies: 'frame' codifica con get_dummies l'intera tabella, 'features' solo le feature,
+                    None nessuna codifica
+    :param label_encode_target: se True codifica il target con LabelEncoder
+    :param test_size: frazione di righe del test set
+    :param random_state: seed della divisione
+    :return: dizionario con X_train, X_test, y_train, y_test, sensitive_train, sensitive_test
+             (le feature sensibili come tabella n x len(sensitive_features))
+    """
+    # Import locale: pandas e scikit-learn servono solo quando la cache non è valida
+    import pandas as pd
+    from sklearn.model_selection import train_test_split
+    from sklearn.preprocessing import LabelEncoder, StandardScaler
+
+    data = pd.read_csv(path)
+    if columns is not None:
+        data = data[list(columns)]
+    if missing_values is not None:
+        data = data.replace(missing_values, pd.NA)
+    data = data.dropna()
+    if dummies == 'frame':
+        data = pd.get_dummies(data, drop_first=True)
+    elif dummies not in ('features', None):
+        raise ValueError("Invalid dummies")
+    if label_encode_target:
+        data[target] = LabelEncoder().fit_transform(data[target])
+
+    y = data[target]
+    X = data.drop(columns=[target] + list(sensitive_features))
+    if dummies == 'features':
+        X = pd.get_dummies(X, drop_first=True)
+    X = StandardScaler().fit_transform(X)
+    split = train_test_split(X, y.to_numpy(), data[list(sensitive_features)].to_numpy(), test_size=test_size,
+                             random_state=random_state)
+    return dict(zip(ARRAYS, split))
+
+
+def load_dataset(path, target, sensitive_features, cache_dir=DEFAULT_CACHE_DIR, **params):
+    """
+    Come preprocess, ma salva il risultato in cache e lo riusa finché file e parametri non cambiano.
+
+    La chiave della cache è lo SHA-256 del file insieme ai parametri di pre-elaborazione; ogni voce
+    è una cartella con un file .npy per array, riaperto in memory-map. Con la cache valida non vengono
+    importati né pandas né scikit-learn.
+
+    :param path: percorso del file CSV
+    :param target: colonna della variabile target
+    :param sensitive_features: lista delle colonne sensibili
+    :param cache_dir: cartella della cache (None disattiva la cache)
+    :param params: altri parametri di preprocess
+    :return: dizionario con X_train, X_test, y_train, y_test, sensitive_train, sensitive_test
+    """
+    sensitive_features = list(sensitive_features)
+    if cache_dir is None:
+        return preprocess(path, target, sensitive_features, **params)
+
+    description = json.dumps({"version": CACHE_VERSION, "file": file_digest(path), "target": target,
+                              "sensitive_features": sensitive_features, **params}, sort_keys=True, default=str)
+    key = hashlib.sha256(description.encode()).hexdigest()[:32]
+    name = os.path.splitext(os.path.basename(path))[0]
+    entry = os.path.join(cache_dir, f"{name}-{key}")
+    if not os.path.isdir(entry):
+        arrays = preprocess(path, target, sensitive_features, **params)
+        temporary = f"{entry}.{os.getpid()}.tmp"
+        os.makedirs(temporary, exist_ok=True)
+        for array_name, values in arrays.items():
+            values = np.asarray(values)
+            # Le stringhe sono salvate come Unicode a lunghezza fissa, così da poterle mappare in memoria
+            if values.dtype == object:
+                values = values.astype(str)
+            np.save(os.path.join(temporary, array_name + '.npy'), values)
+        with open(os.path.join(temporary, 'params.json'), 'w') as f:
+            f.write(description)
+        try:
+            # La voce diventa visibile solo quando è completa
+            os.replace(temporary, entry)
+        except OSError:
+            # Un altro processo ha scritto la stessa voce nel frattempo
+            for file in os.listdir(temporary):
+                os.remove(os.path.join(temporary, file))
+            os.rmdir(temporary)
+    return {array_name: Utilities.load_array(os.path.join(entry, array_name + '.npy')) for array_name in ARRAYS}
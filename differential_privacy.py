@@ -1,103 +1,253 @@
-import random
 import math
 import numpy as np
+from instrumentation import NULL_INSTRUMENTATION
 from utilities import Utilities
 
+# Numero di valori di rumore generati per blocco dai meccanismi numerici
+NOISE_BLOCK_SIZE = 1 << 20
+
+
 class DifferentialPrivacy:
-    def __init__(self, epsilon, delta=0.1):
+    def __init__(self, epsilon, delta=0.1, rng=None, instrumentation=None):
         self.epsilon = epsilon
         self.delta = delta
+        # Misura opzionale di tempi e memoria dei meccanismi, per fase e per epsilon
+        self.instrumentation = instrumentation or NULL_INSTRUMENTATION
+        # Generatore numpy: accetta un seed, un SeedSequence, un BitGenerator o un Generator già costruito
+        self.rng = np.random.default_rng(rng)
+        self._transition_matrices = {}
+
+    def spawn(self, n):
+        """
+        Crea n istanze con gli stessi parametri e flussi casuali indipendenti (SeedSequence.spawn).
 
-    def add_laplace_noise(self, values, sensitivity=1):
+        :param n: Numero di istanze da creare
+        :return: Lista di DifferentialPrivacy
+        """
+        return [DifferentialPrivacy(self.epsilon, self.delta, child, self.instrumentation)
+                for child in self.rng.spawn(n)]
+
+    def jumped(self, jumps=1):
+        """
+        Crea un'istanza il cui generatore è avanzato di `jumps` salti rispetto a quello corrente,
+        ottenendo un flusso che non si sovrappone a quello originale.
+
+        :param jumps: Numero di salti
+        :return: Nuova istanza di DifferentialPrivacy
+        """
+        return DifferentialPrivacy(self.epsilon, self.delta,
+                                   np.random.Generator(self.rng.bit_generator.jumped(jumps)), self.instrumentation)
+
+    def _add_noise(self, values, noise_type, scale, trials, out, dtype):
+        """
+        Somma rumore centrato in zero a un intero array, generandolo a blocchi di dimensione fissa
+        direttamente nel tipo di destinazione per limitare la memoria temporanea.
+        """
+        with self.instrumentation.stage('dp.' + noise_type, epsilon=self.epsilon):
+            return self._add_noise_blocks(np.asarray(values), noise_type, scale, trials, out, dtype)
+
+    def _add_noise_blocks(self, values, noise_type, scale, trials, out, dtype):
+        shape = values.shape if trials is None else (trials,) + values.shape
+        if out is None:
+            if dtype is None:
+                dtype = np.float32 if values.dtype == np.float32 else np.float64
+            out = np.empty(shape, dtype=dtype)
+        elif out.shape != shape or not out.flags.c_contiguous:
+            raise ValueError("out must be a C-contiguous array of shape " + str(shape))
+        if out is not values:
+            out[...] = values
+
+        flat = out.reshape(-1)
+        noise = np.empty(min(NOISE_BLOCK_SIZE, flat.size), dtype=out.dtype)
+        extra = np.empty_like(noise) if noise_type == 'laplace' else None
+        for start in range(0, flat.size, NOISE_BLOCK_SIZE):
+            block = noise[:min(NOISE_BLOCK_SIZE, flat.size - start)]
+            if noise_type == 'laplace':
+                # Differenza di due esponenziali standard indipendenti ~ Laplace(0, 1)
+                self.rng.standard_exponential(out=block, dtype=out.dtype)
+                block -= self.rng.standard_exponential(out=extra[:len(block)], dtype=out.dtype)
+            else:
+                self.rng.standard_normal(out=block, dtype=out.dtype)
+            block *= scale
+            flat[start:start + len(block)] += block
+        return out
+
+    def add_laplace_noise(self, values, sensitivity=1, trials=None, out=None, dtype=None):
         """
         Aggiunge rumore di Laplace ai valori per garantire l'epsilon-Differential Privacy.
 
-        :param values: Lista di valori ai quali si vuole aggiungere il rumore
+        :param values: Lista o array di valori ai quali si vuole aggiungere il rumore
         :param sensitivity: Sensitività della funzione, ovvero il massimo cambiamento nell'output
                             dovuto alla modifica di un singolo record (default = 1)
-        :return: Lista di valori con rumore laplaciano aggiunto
+        :param trials: Se specificato, genera in blocco `trials` estrazioni indipendenti
+        :param out: Array di destinazione (anche `values` stesso, per sommare il rumore sul posto)
+        :param dtype: Tipo dell'array restituito (es. np.float32) quando out non è specificato
+        :return: Array di valori con rumore laplaciano aggiunto (trials x n se trials è specificato)
         """
-        # Calcola il parametro di scala in base a epsilon
-        scale = sensitivity / self.epsilon
-        # Genera rumore di Laplace con media 0 e parametro di scala calcolato
-        noisy_values = [v + random.gauss(0, scale) for v in values]
-        return noisy_values
-    
-    def add_gaussian_noise(self, values, sensitivity=1):
+        # Genera rumore di Laplace con media 0 e parametro di scala sensitivity / epsilon
+        return self._add_noise(values, 'laplace', self.noise_scale('laplace', sensitivity), trials, out, dtype)
+
+    def add_gaussian_noise(self, values, sensitivity=1, trials=None, out=None, dtype=None):
         """
         Aggiunge rumore gaussiano ai valori per garantire l'(epsilon, delta)-Differential Privacy.
 
-        :param values: Lista di valori ai quali si vuole aggiungere il rumore
+        :param values: Lista o array di valori ai quali si vuole aggiungere il rumore
         :param sensitivity: Sensitività della funzione, ovvero il massimo cambiamento nell'output
                             dovuto alla modifica di un singolo record (default = 1)
-        :return: Lista di valori con rumore gaussiano aggiunto
-        """
-        # Calcola sigma in base a epsilon e delta
-        sigma = math.sqrt(2 * math.log(1.25 / self.delta)) * sensitivity / self.epsilon
-        # Genera rumore gaussiano con media 0 e deviazione standard sigma
-        noisy_values = [v + random.gauss(0, sigma) for v in values]
-        return noisy_values
-    
-    def add_laplace_categorical_noise(self, values):
-     """
-     Simula rumore Laplaciano per variabili categoriche senza richiedere la lista delle categorie.
- 
-     :param values: Lista di valori categorici
-     :return: Lista con rumore simulato per le variabili categoriche
-     """
-     # Ottieni i valori unici dai dati
-     categories = list(set(values))
-
-     noisy_values = []
-     for value in values:
-         probabilities = []
-         for cat in categories:
-             # Probabilità decresce esponenzialmente con la "distanza" simulata
-             distance = 1 if cat != value else 0
-             probabilities.append(math.exp(-distance * self.epsilon))
-         # Normalizza per ottenere una distribuzione di probabilità
-         probabilities = np.array(probabilities) / np.sum(probabilities)
-         # Campionamento in base alla distribuzione
-         noisy_value = np.random.choice(categories, p=probabilities)
-         noisy_values.append(noisy_value)
-         noisy_values = [Utilities.convert_to_native(noisy_value) for noisy_value in noisy_values]
-     return noisy_values
-
-    def add_gaussian_categorical_noise(self, values, sensitivity=1.0):
-     """
-     Simula rumore Gaussiano per variabili categoriche senza richiedere la lista delle categorie.
-    
-     :param values: Lista di valori categorici
-     :param sensitivity: Sensitività della funzione, ovvero il massimo cambiamento nell'output dovuto 
-                        alla modifica di un singolo record (default = 1.0)
-     :return: Lista con rumore simulato per le variabili categoriche
-     """
-     # Ottieni i valori unici dai dati
-     categories = list(set(values))
-
-     noisy_values = []
-     for value in values:
-        probabilities = []
-        for cat in categories:
-            # Calcola la distanza tra la categoria corrente e quella osservata
-            distance = 1 if cat != value else 0
-
-            # Probabilità decresce con un profilo gaussiano (centrato sulla categoria originale)
-            # Dove il denominatore è legato alla varianza che aumenta al diminuire di epsilon
-            variance = (2 * (sensitivity ** 2)) / (self.epsilon ** 2)
-            probabilities.append(math.exp(- (distance ** 2) / (2 * variance)))
-
-        # Normalizza per ottenere una distribuzione di probabilità
-        probabilities = np.array(probabilities) / np.sum(probabilities)
-
-         # Campionamento in base alla distribuzione
-        noisy_value = np.random.choice(categories, p=probabilities)
-
-        # Aggiungi il valore disturbato alla lista
-        noisy_values.append(noisy_value)
-
-     # Converti tutti i valori noisy in tipi nativi Python, se necessario
-     noisy_values = [Utilities.convert_to_native(noisy_value) for noisy_value in noisy_values]
-
-     return noisy_values
-   
\ No newline at end of file
+        :param trials: Se specificato, genera in blocco `trials` estrazioni indipendenti
+        :param out: Array di destinazione (anche `values` stesso, per sommare il rumore sul posto)
+        :param dtype: Tipo dell'array restituito (es. np.float32) quando out non è specificato
+        :return: Array di valori con rumore gaussiano aggiunto (trials x n se trials è specificato)
+        """
+        # Genera rumore gaussiano con media 0 e deviazione standard sigma, calcolata da epsilon e delta
+        return self._add_noise(values, 'gaussian', self.noise_scale('gaussian', sensitivity), trials, out, dtype)
+
+    def noise_scale(self, noise_type, sensitivity=1):
+        """
+        Scala del rumore numerico: b = sensitivity / epsilon per Laplace, sigma per il gaussiano.
+
+        :param noise_type: 'laplace' oppure 'gaussian'
+        :param sensitivity: Sensitività della funzione (default = 1)
+        :return: scala per cui moltiplicare un rumore standard
+        """
+        if noise_type == 'laplace':
+            return sensitivity / self.epsilon
+        elif noise_type == 'gaussian':
+            return math.sqrt(2 * math.log(1.25 / self.delta)) * sensitivity / self.epsilon
+        raise ValueError("Invalid noise_type")
+
+    def standard_noise(self, noise_type, shape):
+        """
+        Rumore standard (scala 1) da moltiplicare per noise_scale, ad esempio per riusare le stesse
+        estrazioni con più valori di epsilon.
+
+        :param noise_type: 'laplace' oppure 'gaussian'
+        :param shape: forma dell'array da generare
+        :return: array di rumore standard
+        """
+        if noise_type == 'laplace':
+            return self.rng.standard_exponential(shape) - self.rng.standard_exponential(shape)
+        elif noise_type == 'gaussian':
+            return self.rng.standard_normal(shape)
+        raise ValueError("Invalid noise_type")
+
+    def categorical_transition_matrix(self, k, noise_type='laplace', sensitivity=1.0):
+        """
+        Costruisce la matrice di transizione k x k del meccanismo categorico.
+
+        L'elemento [i, j] è la probabilità di rilasciare la categoria j quando il valore
+        osservato è la categoria i. La matrice viene calcolata una sola volta per istanza.
+
+        :param k: Numero di categorie
+        :param noise_type: 'laplace' oppure 'gaussian'
+        :param sensitivity: Sensitività usata dal profilo gaussiano (default = 1.0)
+        :return: Array numpy k x k con righe che sommano a 1
+        """
+        key = (k, noise_type, sensitivity)
+        if key not in self._transition_matrices:
+            if noise_type == 'laplace':
+                # Probabilità decresce esponenzialmente con la "distanza" simulata
+                off_diagonal = math.exp(-self.epsilon)
+            elif noise_type == 'gaussian':
+                # Profilo gaussiano con varianza che aumenta al diminuire di epsilon
+                variance = (2 * (sensitivity ** 2)) / (self.epsilon ** 2)
+                off_diagonal = math.exp(-1 / (2 * variance))
+            else:
+                raise ValueError("Invalid noise_type")
+            matrix = np.full((k, k), off_diagonal)
+            np.fill_diagonal(matrix, 1.0)
+            self._transition_matrices[key] = matrix / matrix.sum(axis=1, keepdims=True)
+        return self._transition_matrices[key]
+
+    def sample_categorical_codes(self, codes, transition_matrix, trials=None):
+        """
+        Campiona le categorie rumorose per un intero vettore di codici con un'unica
+        inversione vettoriale della funzione di ripartizione.
+
+        :param codes: Array di codici interi delle categorie osservate
+        :param transition_matrix: Matrice k x k restituita da categorical_transition_matrix
+        :param trials: Se specificato, estrae `trials` campioni indipendenti per ogni codice
+        :return: Array di codici interi delle categorie rilasciate (trials x n se trials è specificato)
+        """
+        codes = np.asarray(codes, dtype=np.intp)
+        k = transition_matrix.shape[0]
+        shape = codes.shape if trials is None else (trials,) + codes.shape
+        if k == 0 or codes.size == 0:
+            # Nessun valore da campionare (es. un blocco vuoto): la CDF non ha colonne
+            return np.empty(shape, dtype=np.intp)
+        # Le righe della CDF vengono traslate di i, così da formare un unico vettore crescente
+        cdf = np.cumsum(transition_matrix, axis=1)
+        cdf[:, -1] = 1.0
+        shifted_cdf = (cdf + np.arange(k)[:, None]).ravel()
+        uniforms = self.rng.random(shape)
+        noisy_codes = np.searchsorted(shifted_cdf, codes + uniforms, side='right') - codes * k
+        return np.minimum(noisy_codes, k - 1)
+
+    def coupled_categorical_codes(self, codes, transition_matrix, uniforms, replacements):
+        """
+        Campiona le categorie rumorose da estrazioni fornite dal chiamante (common random numbers).
+
+        Le matrici di categorical_transition_matrix hanno diagonale costante p e probabilità uguali
+        fuori diagonale, quindi il meccanismo equivale a mantenere il codice se u < p e altrimenti
+        rilasciare una delle altre k - 1 categorie scelta uniformemente. Riusando le stesse uniforms e
+        replacements con epsilon crescenti le righe mantenute crescono in modo monotono e ogni nuovo
+        epsilon richiede solo di confrontare le uniformi con una nuova soglia.
+
+        :param codes: Array di codici interi delle categorie osservate
+        :param transition_matrix: Matrice k x k restituita da categorical_transition_matrix
+        :param uniforms: Uniformi in [0, 1) con la forma del risultato (es. trials x n)
+        :param replacements: Interi in [0, k - 2] con la forma del risultato, indice della categoria
+                             sostitutiva tra le k - 1 diverse da quella osservata
+        :return: Array di codici interi delle categorie rilasciate
+        """
+        codes = np.asarray(codes, dtype=np.intp)
+        replaced = replacements + (replacements >= codes)
+        return np.where(uniforms < transition_matrix[0, 0], codes, replaced)
+
+    def _encode_categories(self, values, categories):
+        uniques, codes = Utilities.factorize(values)
+        if categories is None:
+            return uniques, codes
+        # Categorie fissate dal chiamante (es. per applicare lo stesso meccanismo a blocchi di dati)
+        categories = np.asarray(categories)
+        positions = {Utilities.convert_to_native(c): i for i, c in enumerate(categories)}
+        try:
+            lookup = np.array([positions[Utilities.convert_to_native(u)] for u in uniques], dtype=np.intp)
+        except KeyError as missing:
+            raise ValueError(f"Value {missing} is not among the given categories") from None
+        return categories, lookup[codes]
+
+    def _add_categorical_noise(self, values, noise_type, sensitivity, native, trials, categories):
+        with self.instrumentation.stage('dp.' + noise_type + '_categorical', epsilon=self.epsilon):
+            categories, codes = self._encode_categories(values, categories)
+            matrix = self.categorical_transition_matrix(len(categories), noise_type, sensitivity)
+            noisy_values = categories[self.sample_categorical_codes(codes, matrix, trials)]
+        # Converti in tipi nativi Python solo se richiesto
+        return Utilities.convert_to_native(noisy_values) if native else noisy_values
+
+    def add_laplace_categorical_noise(self, values, native=False, trials=None, categories=None):
+        """
+        Simula rumore Laplaciano per variabili categoriche senza richiedere la lista delle categorie.
+
+        :param values: Lista di valori categorici
+        :param native: Se True restituisce una lista di tipi nativi Python invece di un array numpy
+        :param trials: Se specificato, genera in blocco `trials` estrazioni indipendenti (array trials x n)
+        :param categories: Elenco completo delle categorie; se omesso viene ricavato dai valori
+        :return: Array con rumore simulato per le variabili categoriche
+        """
+        return self._add_categorical_noise(values, 'laplace', 1.0, native, trials, categories)
+
+    def add_gaussian_categorical_noise(self, values, sensitivity=1.0, native=False, trials=None,
+                                       categories=None):
+        """
+        Simula rumore Gaussiano per variabili categoriche senza richiedere la lista delle categorie.
+
+        :param values: Lista di valori categorici
+        :param sensitivity: Sensitività della funzione, ovvero il massimo cambiamento nell'output dovuto
+                           alla modifica di un singolo record (default = 1.0)
+        :param native: Se True restituisce una lista di tipi nativi Python invece di un array numpy
+        :param trials: Se specificato, genera in blocco `trials` estrazioni indipendenti (array trials x n)
+        :param categories: Elenco completo delle categorie; se omesso viene ricavato dai valori
+        :return: Array con rumore simulato per le variabili categoriche
+        """
+        return self._add_categorical_noise(values, 'gaussian', sensitivity, native, trials, categories)
@@ -0,0 +1,127 @@
+import numpy as np
+from fairness_metrics import N_OUTCOMES, label_cells, label_group_sums, prediction_counts
+from model_evaluator import confusion_matrices, encode_labels
+from parallel_metrics import SharedArray, parallel_confusion_matrices, parallel_prediction_counts
+from utilities import Utilities
+
+
+class EncodedDataset:
+    def __init__(self, labels, sensitive_features):
+        """
+        Etichette e feature sensibili di un insieme di test, codificate una sola volta.
+
+        Lo stesso oggetto può essere passato a più Toolkit, FairnessMetrics e ModelEvaluator
+        (es. per valutare molti modelli sullo stesso test set): per ogni modello restano da
+        calcolare solo i conteggi che dipendono dalle predizioni. Array numpy, array memory-mapped
+        e pandas Series vengono letti senza copia e i codici sono salvati in tipi interi compatti.
+
+        :param labels: etichette reali, oppure percorso di un file .npy (aperto in memory-map)
+        :param sensitive_features: feature sensibile, tabella n x m di più feature sensibili,
+                                   oppure percorso di un file .npy
+        """
+        labels = Utilities.load_array(labels)
+        sensitive_features = Utilities.load_array(sensitive_features)
+        self.labels = np.asarray(labels)
+        self.sensitive_features = sensitive_features
+        self.groups, self.group_codes = Utilities.factorize_groups(sensitive_features)
+        n_groups = len(self.groups)
+
+        # Cella del tensore di confusione senza l'esito della predizione
+        self.label_cells = label_cells(self.group_codes, n_groups, self.labels)
+        self.label_sums = label_group_sums(self.group_codes, n_groups, self.labels)
+        # Le celle con esito di predizione 0 contano le righe per (gruppo, esito etichetta)
+        cell_counts = Utilities.blocked_bincount(self.label_cells, minlength=n_groups * N_OUTCOMES ** 2)
+        self.label_counts = cell_counts.reshape(n_groups, N_OUTCOMES, N_OUTCOMES)[..., 0]
+        self.classes, self.class_codes = encode_labels(self.labels)
+
+        # Indici delle righe di ogni gruppo in formato CSR: group_rows[offsets[g]:offsets[g + 1]]
+        self.group_sizes = self.label_counts.sum(axis=1)
+        self.group_offsets = np.concatenate([[0], np.cumsum(self.group_sizes)])
+        self._group_rows = None
+        # Copie in memoria condivisa degli array invarianti, create al primo conteggio parallelo
+        self._shared = {}
+
+    def __len__(self):
+        return len(self.labels)
+
+    def __getstate__(self):
+        # I segmenti condivisi appartengono al processo che li ha creati e non vengono serializzati
+        state = self.__dict__.copy()
+        state['_shared'] = {}
+        return state
+
+    def _shared_array(self, name):
+        """Attributo `name` come SharedArray, condiviso una sola volta con i worker di tutti i conteggi."""
+        array = getattr(self, name)
+        if array.dtype.hasobject:
+            # Array di oggetti Python: sharded_map esegue il conteggio nel processo corrente
+            return array
+        if name not in self._shared:
+            self._shared[name] = SharedArray(array)
+        return self._shared[name]
+
+    def close(self):
+        """Rimuove le copie in memoria condivisa create per i conteggi paralleli."""
+        shared, self._shared = self._shared, {}
+        for array in shared.values():
+            array.close()
+
+    @property
+    def group_rows(self):
+        """Indici delle righe ordinati per gruppo, calcolati al primo utilizzo."""
+        if self._group_rows is None:
+            self._group_rows = np.argsort(self.group_codes, kind='stable')
+        return self._group_rows
+
+    def rows_of_group(self, index):
+        """Restituisce gli indici delle righe del gruppo in posizione index."""
+        return self.group_rows[self.group_offsets[index]:self.group_offsets[index + 1]]
+
+    def _check_predictions(self, predictions):
+        predictions = np.asarray(predictions)
+        if predictions.shape[-1] != len(self.labels):
+            raise ValueError("predictions and labels must have the same length")
+        return predictions
+
+    def prediction_counts(self, predictions, n_jobs=1):
+        """
+        Conteggi per gruppo delle predizioni di un modello (o di più ripetizioni, shape (..., n)).
+
+        :param n_jobs: se diverso da 1, conta porzioni di righe in parallelo su un pool di processi
+                       persistente (None o -1 usa tutti i core); gli array del dataset vengono
+                       condivisi con i worker una sola volta, a ogni chiamata si copiano solo le predizioni
+        :return: tupla (counts, correct, prediction_sums) come in grouped_confusion
+        """
+        predictions = self._check_predictions(predictions)
+        if n_jobs != 1:
+            return parallel_prediction_counts(self._shared_array('group_codes'), len(self.groups),
+                                              self._shared_array('label_cells'), self._shared_array('labels'),
+                                              predictions, n_jobs)
+        return prediction_counts(self.group_codes, len(self.groups), self.label_cells, self.labels, predictions)
+
+    def category_counts(self, predictions):
+        """
+        Conteggi per [gruppo, classe dell'etichetta, categoria predetta], base dei valori attesi
+        delle metriche sotto rumore categorico (fairness_metrics.expected_confusion).
+
+        :param predictions: predizioni categoriche del modello
+        :return: tupla (categories, counts) con counts di shape (G, len(classes), len(categories))
+        """
+        categories, codes = Utilities.factorize(self._check_predictions(predictions))
+        shape = (len(self.groups), len(self.classes), len(categories))
+        counts = np.zeros(int(np.prod(shape)), dtype=np.int64)
+        for block in Utilities.row_blocks(len(codes)):
+            keys = (self.group_codes[block].astype(np.intp) * shape[1] + self.class_codes[block]) * shape[2]
+            counts += np.bincount(keys + codes[block], minlength=len(counts))
+        return categories, counts.reshape(shape)
+
+    def confusion_matrices(self, y_pred, n_jobs=1):
+        """
+        Matrici di confusione (..., K, K + 1) delle predizioni rispetto alle classi delle etichette.
+
+        :param n_jobs: se diverso da 1, conta porzioni di righe in parallelo su un pool di processi
+        """
+        y_pred = self._check_predictions(y_pred)
+        if n_jobs != 1:
+            return parallel_confusion_matrices(self.classes, self._shared_array('class_codes'), y_pred, n_jobs)
+        return confusion_matrices(self.classes, self.class_codes, y_pred)
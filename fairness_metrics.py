@@ -1,226 +1,661 @@
+import numpy as np
+from instrumentation import NULL_INSTRUMENTATION, instrumented
+from utilities import Utilities
+
+# Codici degli esiti usati nel tensore di confusione: 0 e 1 sono i valori binari,
+# OTHER raccoglie qualsiasi altro valore (classi aggiuntive, predizioni rumorose continue)
+NEGATIVE, POSITIVE, OTHER = 0, 1, 2
+N_OUTCOMES = 3
+
+
+def outcome_codes(values):
+    """
+    Converte etichette o predizioni nei codici di esito 0, 1 e OTHER.
+
+    :param values: array di etichette o predizioni
+    :return: array di interi a 8 bit con lo stesso shape di values
+    """
+    values = np.asarray(values)
+    codes = np.full(values.shape, OTHER, dtype=np.int8)
+    codes[values == 0] = NEGATIVE
+    codes[values == 1] = POSITIVE
+    return codes
+
+
+def numeric_or_none(values):
+    """Restituisce values come array float, oppure None se i valori non sono numerici."""
+    try:
+        return np.asarray(values, dtype=float)
+    except (TypeError, ValueError):
+        return None
+
+
+def label_cells(group_codes, n_groups, labels):
+    """
+    Parte del codice di cella del tensore di confusione che dipende solo da gruppo ed etichetta:
+    la cella di una riga è label_cells + esito della predizione.
+
+    :param group_codes: codici interi dei gruppi
+    :param n_groups: numero di gruppi
+    :param labels: etichette reali
+    :return: array (gruppo * 3 + esito etichetta) * 3 nel tipo intero più piccolo sufficiente
+    """
+    dtype = np.min_scalar_type(n_groups * N_OUTCOMES ** 2)
+    cells = np.empty(len(group_codes), dtype=dtype)
+    for block in Utilities.row_blocks(len(group_codes)):
+        cells[block] = (group_codes[block].astype(dtype) * N_OUTCOMES + outcome_codes(labels[block])) * N_OUTCOMES
+    return cells
+
+
+def prediction_counts(group_codes, n_groups, cells, labels, predictions):
+    """
+    Conteggi per gruppo che dipendono dalle predizioni, a partire dalle celle precalcolate
+    con label_cells. Le righe sono elaborate a blocchi, quindi input compatti o memory-mapped
+    vengono convertiti in interi a 64 bit e float solo un blocco alla volta.
+
+    :return: tupla (counts, correct, prediction_sums)
+    """
+    labels = np.asarray(labels)
+    predictions = np.asarray(predictions)
+    batch_shape = predictions.shape[:-1]
+    n_batches = int(np.prod(batch_shape, dtype=np.intp))
+
+    # Ogni ripetizione occupa un blocco distinto di n_groups celle
+    batch_offsets = (np.arange(n_batches) * n_groups).reshape(batch_shape + (1,))
+    n_cells = n_batches * n_groups
+    numeric_predictions = predictions if predictions.dtype.kind in 'biuf' else numeric_or_none(predictions)
+
+    counts = np.zeros(n_cells * N_OUTCOMES ** 2, dtype=np.int64)
+    correct = np.zeros(n_cells)
+    prediction_sums = np.zeros(n_cells) if numeric_predictions is not None else None
+    for block in Utilities.row_blocks(predictions.shape[-1]):
+        chunk = predictions[..., block]
+        batched_groups = (group_codes[block] + batch_offsets).ravel()
+        flat = cells[block] + batch_offsets * N_OUTCOMES ** 2 + outcome_codes(chunk)
+        counts += np.bincount(flat.ravel(), minlength=n_cells * N_OUTCOMES ** 2)
+        correct += np.bincount(batched_groups, weights=(chunk == labels[block]).ravel(), minlength=n_cells)
+        if prediction_sums is not None:
+            prediction_sums += np.bincount(batched_groups, minlength=n_cells,
+                                           weights=np.asarray(numeric_predictions[..., block], dtype=float).ravel())
+
+    counts = counts.reshape(batch_shape + (n_groups, N_OUTCOMES, N_OUTCOMES))
+    correct = correct.reshape(batch_shape + (n_groups,))
+    if prediction_sums is not None:
+        prediction_sums = prediction_sums.reshape(batch_shape + (n_groups,))
+    return counts, correct, prediction_sums
+
+
+def label_group_sums(group_codes, n_groups, labels):
+    """Somma delle etichette per gruppo, oppure None se le etichette non sono numeriche."""
+    labels = np.asarray(labels)
+    if labels.dtype.kind not in 'biuf':
+        labels = numeric_or_none(labels)
+        if labels is None:
+            return None
+    return Utilities.blocked_bincount(group_codes, weights=labels, minlength=n_groups)
+
+
+def expected_confusion(joint_counts, label_values, categories, transition_matrices):
+    """
+    Conteggi attesi per gruppo quando le predizioni categoriche vengono sostituite secondo una
+    matrice di transizione (randomized response), senza campionare il rumore.
+
+    :param joint_counts: conteggi puliti (G, A, k) per [gruppo, valore etichetta, categoria predetta]
+    :param label_values: gli A valori delle etichette
+    :param categories: le k categorie delle predizioni
+    :param transition_matrices: matrici (..., k, k), una per ogni valore di epsilon
+    :return: tupla (counts, correct, prediction_sums) con dimensioni iniziali pari a quelle delle matrici
+    """
+    # Conteggio atteso di ogni categoria rilasciata: somma sulle categorie osservate pesata da T[c, j]
+    expected = np.einsum('gac,...cj->...gaj', joint_counts, transition_matrices)
+    label_outcomes = np.eye(N_OUTCOMES)[outcome_codes(label_values)]
+    category_outcomes = np.eye(N_OUTCOMES)[outcome_codes(categories)]
+    counts = np.einsum('...gaj,ax,jy->...gxy', expected, label_outcomes, category_outcomes)
+
+    matches = np.array([[label == category for category in np.asarray(categories).tolist()]
+                        for label in np.asarray(label_values).tolist()], dtype=float)
+    correct = np.einsum('...gaj,aj->...g', expected, matches)
+    numeric_categories = numeric_or_none(categories)
+    prediction_sums = (np.einsum('...gaj,j->...g', expected, numeric_categories)
+                       if numeric_categories is not None else None)
+    return counts, correct, prediction_sums
+
+
+def grouped_confusion(group_codes, n_groups, labels, predictions):
+    """
+    Costruisce in un unico passaggio vettoriale i conteggi per gruppo necessari alle metriche.
+
+    Le predizioni possono avere dimensioni iniziali aggiuntive (es. trials x n): in questo caso
+    tutte le ripetizioni vengono contate insieme e i risultati hanno le stesse dimensioni iniziali.
+
+    :param group_codes: codici interi dei gruppi (0 .. n_groups - 1)
+    :param n_groups: numero di gruppi
+    :param labels: etichette reali
+    :param predictions: predizioni del modello, shape (n,) oppure (..., n)
+    :return: tupla (counts, correct, prediction_sums, label_sums) dove counts ha shape
+             (..., n_groups, 3, 3) ed è indicizzato per [gruppo, esito etichetta, esito predizione]
+    """
+    labels = np.asarray(labels)
+    counts, correct, prediction_sums = prediction_counts(
+        group_codes, n_groups, label_cells(group_codes, n_groups, labels), labels, predictions)
+    return counts, correct, prediction_sums, label_group_sums(group_codes, n_groups, labels)
+
+
+# Divisione che restituisce 0 dove il denominatore è nullo
+_ratio = Utilities.safe_divide
+
+
+def _spread(values):
+    """Differenza tra il valore massimo e minimo tra i gruppi (ultimo asse)."""
+    return _native(values.max(axis=-1) - values.min(axis=-1))
+
+
+def _native(value):
+    """Converte i risultati scalari in float Python, lasciando invariati gli array."""
+    return float(value) if np.ndim(value) == 0 else value
+
+
+def _largest_gaps(rates, top_k):
+    """
+    Trova le top_k coppie di gruppi con la differenza assoluta di tasso più grande.
+
+    Ogni coppia tra le prime top_k è formata da uno dei top_k tassi minori e uno dei top_k
+    maggiori, quindi basta una selezione parziale sui candidati (O(G + top_k^2)).
+    """
+    n_groups = len(rates)
+    k = min(top_k, n_groups)
+    if k == 0 or n_groups < 2:
+        return []
+    lowest = np.argpartition(rates, k - 1)[:k]
+    highest = np.argpartition(-rates, k - 1)[:k]
+    first, second = np.meshgrid(lowest, highest, indexing='ij')
+    first, second = np.minimum(first, second).ravel(), np.maximum(first, second).ravel()
+    # Elimina le coppie degeneri e i duplicati quando i due insiemi di candidati si sovrappongono
+    pairs = np.unique(np.stack([first, second], axis=1)[first != second], axis=0)
+    gaps = np.abs(rates[pairs[:, 0]] - rates[pairs[:, 1]])
+    order = np.argsort(-gaps, kind='stable')[:top_k]
+    # Ogni coppia è orientata come (gruppo con tasso minore, gruppo con tasso maggiore)
+    return [(int(i), int(j), float(gap)) if rates[i] <= rates[j] else (int(j), int(i), float(gap))
+            for (i, j), gap in zip(pairs[order], gaps[order])]
+
+
+# Metriche scalari (o tuple/dizionari di scalari) calcolate da FairnessMetrics
+METRIC_METHODS = [
+    "compute_statistical_parity",
+    "compute_equalized_odds",
+    "compute_predictive_parity",
+    "compute_accuracy_parity",
+    "compute_false_positive_parity",
+    "compute_positive_rate_parity",
+    "compute_predictive_value_parity",
+    "compute_equal_opportunity",
+    "compute_well_calibration",
+    "compute_balance_for_positive_class",
+    "compute_balance_for_negative_class",
+]
+
+
+def _interval(estimate, samples, confidence):
+    """Intervallo percentile bootstrap; si applica ricorsivamente a tuple e dizionari di metriche."""
+    if isinstance(estimate, dict):
+        return {key: _interval(estimate[key], samples[key], confidence) for key in estimate}
+    if isinstance(estimate, tuple):
+        return tuple(_interval(e, s, confidence) for e, s in zip(estimate, samples))
+    alpha = (1 - confidence) / 2
+    lower, upper = np.quantile(samples, [alpha, 1 - alpha])
+    return {"estimate": estimate, "std": float(np.std(samples, ddof=1)),
+            "lower": float(lower), "upper": float(upper)}
+
+
 class FairnessMetrics:
- def __init__(self, predictions, labels,sensitive_features):
+ def __init__(self, predictions, labels,sensitive_features, min_support=0, instrumentation=None):
+        """
+        :param predictions: Predizioni del modello
+        :param labels: Etichette reali
+        :param sensitive_features: Feature sensibile, oppure tabella n x m di più feature sensibili:
+                                   in questo caso le metriche sono calcolate sulle loro intersezioni
+        :param min_support: Numero minimo di righe perché un gruppo venga considerato
+        :param instrumentation: Instrumentation che misura tempi e memoria delle singole fasi
+        """
+        self.instrumentation = instrumentation or NULL_INSTRUMENTATION
         self.predictions = predictions
         self.labels = labels
         self.sensitive_features = sensitive_features
 
+        # Fattorizza i gruppi una sola volta e costruisce il tensore (gruppo x etichetta x predizione)
+        with self.instrumentation.stage('fairness.grouped_confusion'):
+            self.groups, self.group_codes = Utilities.factorize_groups(sensitive_features)
+            self.counts, self.correct, self.prediction_sums, self.label_sums = grouped_confusion(
+                self.group_codes, len(self.groups), labels, predictions)
+        if min_support > 0:
+            self._drop_small_groups(min_support)
+
+ def _drop_small_groups(self, min_support):
+        """Esclude dalle metriche i gruppi con meno di min_support righe."""
+        supported = self._group_totals() >= min_support
+        while supported.ndim > 1:
+            supported = supported.all(axis=0)
+        if not supported.any():
+            raise ValueError("No group reaches the minimum support")
+        # Le righe dei gruppi esclusi ricevono codice -1, nel tipo con segno più piccolo sufficiente
+        dtype = np.promote_types(np.int8, np.min_scalar_type(len(self.groups)))
+        remap = np.full(len(self.groups), -1, dtype=dtype)
+        remap[supported] = np.arange(np.count_nonzero(supported))
+        self.group_codes = remap[self.group_codes]
+        self.groups = self.groups[supported]
+        self.counts = self.counts[..., supported, :, :]
+        self.correct = self.correct[..., supported]
+        if self.prediction_sums is not None:
+            self.prediction_sums = self.prediction_sums[..., supported]
+        if self.label_sums is not None:
+            self.label_sums = self.label_sums[supported]
+
+ @classmethod
+ def from_counts(cls, groups, counts, correct, prediction_sums=None, label_sums=None, instrumentation=None):
+        """
+        Costruisce le metriche direttamente da conteggi per gruppo già aggregati
+        (es. da un accumulatore o dalla somma di risultati parziali).
+
+        :param groups: valori dei gruppi, nello stesso ordine dei conteggi
+        :param counts: tensore (..., G, 3, 3) dei conteggi [gruppo, esito etichetta, esito predizione]
+        :param correct: numero di predizioni corrette per gruppo
+        :param prediction_sums: somma delle predizioni per gruppo (None se non numeriche)
+        :param label_sums: somma delle etichette per gruppo (None se non numeriche)
+        :param instrumentation: Instrumentation che misura tempi e memoria delle singole fasi
+        :return: istanza di FairnessMetrics
+        """
+        fm = cls.__new__(cls)
+        fm.instrumentation = instrumentation or NULL_INSTRUMENTATION
+        fm.predictions = fm.labels = fm.sensitive_features = None
+        fm.groups = np.asarray(groups)
+        fm.group_codes = None
+        fm.counts = np.asarray(counts)
+        fm.correct = np.asarray(correct)
+        fm.prediction_sums = None if prediction_sums is None else np.asarray(prediction_sums)
+        fm.label_sums = None if label_sums is None else np.asarray(label_sums)
+        return fm
+
+ @classmethod
+ def from_dataset(cls, predictions, dataset, min_support=0, instrumentation=None, n_jobs=1):
+        """
+        Costruisce le metriche per le predizioni di un modello su un EncodedDataset: gruppi e
+        etichette sono già codificati, quindi si calcolano solo i conteggi che dipendono dalle predizioni.
+
+        :param predictions: Predizioni del modello, shape (n,) oppure (..., n)
+        :param dataset: EncodedDataset con etichette e feature sensibili
+        :param min_support: Numero minimo di righe perché un gruppo venga considerato
+        :param instrumentation: Instrumentation che misura tempi e memoria delle singole fasi
+        :param n_jobs: numero di processi tra cui suddividere le righe per il conteggio
+        :return: istanza di FairnessMetrics
+        """
+        fm = cls.__new__(cls)
+        fm.instrumentation = instrumentation or NULL_INSTRUMENTATION
+        fm.predictions = predictions
+        fm.labels = dataset.labels
+        fm.sensitive_features = dataset.sensitive_features
+        fm.groups = dataset.groups
+        fm.group_codes = dataset.group_codes
+        with fm.instrumentation.stage('fairness.grouped_confusion'):
+            fm.counts, fm.correct, fm.prediction_sums = dataset.prediction_counts(predictions, n_jobs)
+        fm.label_sums = dataset.label_sums
+        if min_support > 0:
+            fm._drop_small_groups(min_support)
+        return fm
+
+ @property
+ def group_names(self):
+        """Valori dei gruppi convertiti in tipi nativi Python."""
+        return [Utilities.convert_to_native(group) for group in self.groups]
+
+ def _group_totals(self):
+        return self.counts.sum(axis=(-1, -2))
+
+ def _actual_positives(self):
+        return self.counts[..., POSITIVE, :].sum(axis=-1)
+
+ def _actual_negatives(self):
+        return self.counts[..., NEGATIVE, :].sum(axis=-1)
+
+ def _true_positive_rates(self):
+        return _ratio(self.counts[..., POSITIVE, POSITIVE], self._actual_positives())
+
+ def _false_positive_rates(self):
+        return _ratio(self.counts[..., NEGATIVE, POSITIVE], self._actual_negatives())
+
+ def _group_accuracies(self):
+        return _ratio(self.correct, self._group_totals())
+
+ def _require_sums(self, sums, name):
+        if sums is None:
+            raise TypeError(f"This metric requires numeric {name}")
+        return sums
+
+ @instrumented('fairness.statistical_parity')
  def compute_statistical_parity(self):
         """
         Calcola la parità demografica per gruppi protetti generici.
 
         :return: La differenza massima di parità statistica tra i gruppi.
         """
-        unique_groups = set(self.sensitive_features)
-        group_parity = {}
-
-        for group in unique_groups:
-            # Filtra le predizioni per il gruppo attuale
-            group_predictions = [
-                self.predictions[i]
-                for i in range(len(self.sensitive_features))
-                if self.sensitive_features[i] == group
-            ]
-            # Calcola la proporzione di predizioni positive per il gruppo
-            group_parity[group] = (
-                sum(group_predictions) / len(group_predictions) if group_predictions else 0
-            )
+        # Proporzione (media) delle predizioni per ciascun gruppo
+        prediction_sums = self._require_sums(self.prediction_sums, "predictions")
+        group_parity = _ratio(prediction_sums, self._group_totals())
 
         # Calcola la differenza massima tra le parità dei gruppi
-        max_parity_difference = max(group_parity.values()) - min(group_parity.values())
-        return max_parity_difference
-    
+        return _spread(group_parity)
+
+ @instrumented('fairness.equalized_odds')
  def compute_equalized_odds(self):
     """Calcola la metrica Equalized Odds per più classi."""
-    unique_groups = set(self.sensitive_features)
-    metrics = {group: {"tpr": 0, "fpr": 0, "true_positive": 0, "false_positive": 0} for group in unique_groups}
-
-    for i in range(len(self.sensitive_features)):
-        pred, label, group = self.predictions[i], self.labels[i], self.sensitive_features[i]
-        
-        if label == 1 and pred == 1:
-            metrics[group]["true_positive"] += 1  # True Positive
-        elif label == 0 and pred == 1:
-            metrics[group]["false_positive"] += 1  # False Positive
-
-    # Calculate TPR and FPR for each group
-    for group in unique_groups:
-        total_positives = sum(1 for i in range(len(self.labels)) if self.labels[i] == 1 and self.sensitive_features[i] == group)
-        total_negatives = sum(1 for i in range(len(self.labels)) if self.labels[i] == 0 and self.sensitive_features[i] == group)
-
-        metrics[group]["tpr"] = metrics[group]["true_positive"] / total_positives if total_positives else 0
-        metrics[group]["fpr"] = metrics[group]["false_positive"] / total_negatives if total_negatives else 0
-
-    # Calculate differences
-    # Calculate differences
+    tpr = self._true_positive_rates()
+    fpr = self._false_positive_rates()
+    groups = self.group_names
+
+    # Calculate differences between every pair of groups
     differences = {}
-    # Convert the set to a list to access elements by index
-    unique_groups_list = list(unique_groups)
-
-    for i, group in enumerate(unique_groups_list):
-        for other_group in unique_groups_list[i + 1:]:  # Only consider groups after the current one
-            differences[(group, other_group)] = {
-            "tpr_difference": abs(metrics[group]["tpr"] - metrics[other_group]["tpr"]),
-            "fpr_difference": abs(metrics[group]["fpr"] - metrics[other_group]["fpr"]),
-        }
+    for i, group in enumerate(groups):
+        for j in range(i + 1, len(groups)):  # Only consider groups after the current one
+            differences[(group, groups[j])] = {
+                "tpr_difference": _native(abs(tpr[..., i] - tpr[..., j])),
+                "fpr_difference": _native(abs(fpr[..., i] - fpr[..., j])),
+            }
 
     return differences
 
+ @instrumented('fairness.equalized_odds_gaps')
+ def compute_equalized_odds_gaps(self, top_k=10, return_matrices=True):
+        """
+        Versione matriciale di compute_equalized_odds, adatta a un numero elevato di gruppi.
 
+        Invece del dizionario con una voce per coppia di gruppi restituisce le matrici delle
+        differenze di TPR e FPR e le statistiche riassuntive. Le coppie peggiori si trovano tra i
+        top_k gruppi con tasso minore e i top_k con tasso maggiore, quindi non serve la matrice G x G.
 
-
-
-
+        :param top_k: numero di coppie peggiori da riportare per TPR e FPR
+        :param return_matrices: se False non costruisce le matrici G x G delle differenze
+        :return: dizionario con tassi per gruppo, matrici delle differenze (opzionali), differenza
+                 massima con la relativa coppia e le top_k coppie peggiori
+        """
+        # Le matrici e le coppie peggiori assumono tassi 1-D, un valore per gruppo
+        if self.counts.ndim != 3:
+            raise ValueError("Equalized odds gaps require unbatched counts")
+        groups = self.group_names
+        result = {"groups": groups}
+        for name, rates in (("tpr", self._true_positive_rates()), ("fpr", self._false_positive_rates())):
+            result[name] = rates
+            if return_matrices:
+                result[f"{name}_gap"] = np.abs(rates[:, None] - rates[None, :])
+            highest, lowest = int(np.argmax(rates)), int(np.argmin(rates))
+            result[f"max_{name}_gap"] = float(rates[highest] - rates[lowest])
+            result[f"max_{name}_pair"] = (groups[lowest], groups[highest])
+            result[f"top_{name}_pairs"] = [(groups[i], groups[j], gap) for i, j, gap in _largest_gaps(rates, top_k)]
+        return result
+
+ @instrumented('fairness.predictive_parity')
  def compute_predictive_parity(self):
     """
     Calcola la metrica Predictive Parity.
-    
+
     :return: Differenza nella precisione tra i gruppi
     """
-    # Identifica i gruppi unici basati sulle caratteristiche sensibili
-    unique_groups = set(self.sensitive_features)
-
-    # Crea un dizionario per memorizzare le precisioni per ogni gruppo
-    group_precisions = {}
-
-    for group in unique_groups:
-        group_correct = sum(1 for i in range(len(self.predictions))
-                            if self.predictions[i] == self.labels[i] and self.sensitive_features[i] == group)
-        group_total = sum(1 for i in range(len(self.sensitive_features)) 
-                          if self.sensitive_features[i] == group)
-
-        # Calcola la precisione per il gruppo
-        precision_group = group_correct / group_total if group_total > 0 else 0
-        group_precisions[group] = precision_group
+    # Precisione (predizioni corrette / totale) per ogni gruppo
+    precision_values = self._group_accuracies()
 
     # Calcola la differenza di precisione tra i gruppi
-    precision_values = list(group_precisions.values())
-    if len(precision_values) > 1:
-        return abs(precision_values[0] - precision_values[1])  # Return difference between first two groups
+    if precision_values.shape[-1] > 1:
+        return _native(abs(precision_values[..., 0] - precision_values[..., 1]))  # Return difference between first two groups
     else:
         return 0  # Not enough groups to calculate difference
- 
+
+ @instrumented('fairness.accuracy_parity')
  def compute_accuracy_parity(self):
         """Calculate accuracy parity for protected groups."""
-        unique_groups = set(self.sensitive_features)
-        group_accuracy = {}
-        
-        for group in unique_groups:
-            group_correct = sum(1 for i in range(len(self.predictions)) 
-                                if self.predictions[i] == self.labels[i] and self.sensitive_features[i] == group)
-            group_total = sum(1 for i in range(len(self.sensitive_features)) 
-                              if self.sensitive_features[i] == group)
-            group_accuracy[group] = group_correct / group_total if group_total > 0 else 0
-        
-        return max(group_accuracy.values()) - min(group_accuracy.values())
+        return _spread(self._group_accuracies())
 
+ @instrumented('fairness.false_positive_parity')
  def compute_false_positive_parity(self):
         """Calculate false positive parity for protected groups."""
-        unique_groups = set(self.sensitive_features)
-        group_false_positive_rate = {}
-
-        for group in unique_groups:
-            false_positives = sum(1 for i in range(len(self.predictions))
-                                  if self.predictions[i] == 1 and self.labels[i] == 0 and self.sensitive_features[i] == group)
-            total_negatives = sum(1 for i in range(len(self.sensitive_features))
-                                  if self.sensitive_features[i] == group and self.labels[i] == 0)
-            group_false_positive_rate[group] = false_positives / total_negatives if total_negatives > 0 else 0
-
-        return max(group_false_positive_rate.values()) - min(group_false_positive_rate.values())
-  
+        return _spread(self._false_positive_rates())
+
+ @instrumented('fairness.positive_rate_parity')
  def compute_positive_rate_parity(self):
         """Calculate positive rate parity for protected groups."""
-        unique_groups = set(self.sensitive_features)
-        group_positive_rate = {}
-
-        for group in unique_groups:
-            positives = sum(1 for i in range(len(self.predictions))
-                            if self.predictions[i] == 1 and self.sensitive_features[i] == group)
-            total_for_group = sum(1 for i in range(len(self.sensitive_features))
-                                  if self.sensitive_features[i] == group)
-            group_positive_rate[group] = positives / total_for_group if total_for_group > 0 else 0
-
-        return max(group_positive_rate.values()) - min(group_positive_rate.values())
+        positives = self.counts[..., :, POSITIVE].sum(axis=-1)
+        return _spread(_ratio(positives, self._group_totals()))
 
+ @instrumented('fairness.predictive_value_parity')
  def compute_predictive_value_parity(self):
         """Calculate predictive value parity for protected groups."""
-        unique_groups = set(self.sensitive_features)
-        group_predictive_value = {}
-
-        for group in unique_groups:
-            true_positives = sum(1 for i in range(len(self.predictions))
-                                 if self.predictions[i] == 1 and self.labels[i] == 1 and self.sensitive_features[i] == group)
-            total_predicted_positive = sum(1 for i in range(len(self.sensitive_features))
-                                            if self.sensitive_features[i] == group and self.predictions[i] == 1)
-            true_negatives = sum(1 for i in range(len(self.predictions))
-                                 if self.predictions[i] == 0 and self.labels[i] == 0 and self.sensitive_features[i] == group)
-            total_predicted_negative = sum(1 for i in range(len(self.sensitive_features))
-                                            if self.sensitive_features[i] == group and self.predictions[i] == 0)
+        true_positives = self.counts[..., POSITIVE, POSITIVE]
+        true_negatives = self.counts[..., NEGATIVE, NEGATIVE]
+        total_predicted_positive = self.counts[..., :, POSITIVE].sum(axis=-1)
+        total_predicted_negative = self.counts[..., :, NEGATIVE].sum(axis=-1)
 
-            ppv = true_positives / (true_positives + total_predicted_positive) if total_predicted_positive > 0 else 0
-            npv = true_negatives / (true_negatives + total_predicted_negative) if total_predicted_negative > 0 else 0
-            
-            group_predictive_value[group] = (ppv, npv)
+        ppv = _ratio(true_positives, true_positives + total_predicted_positive)
+        npv = _ratio(true_negatives, true_negatives + total_predicted_negative)
 
-        ppv_values = [values[0] for values in group_predictive_value.values()]
-        npv_values = [values[1] for values in group_predictive_value.values()]
-
-        return (max(ppv_values) - min(ppv_values), max(npv_values) - min(npv_values))
+        return (_spread(ppv), _spread(npv))
 
+ @instrumented('fairness.equal_opportunity')
  def compute_equal_opportunity(self):
         """Calculate equal opportunity for protected groups."""
-        unique_groups = set(self.sensitive_features)
-        group_equal_opportunity = {}
-
-        for group in unique_groups:
-            true_positives = sum(1 for i in range(len(self.predictions))
-                                 if self.predictions[i] == 1 and self.labels[i] == 1 and self.sensitive_features[i] == group)
-            total_actual_positives = sum(1 for i in range(len(self.sensitive_features))
-                                          if self.sensitive_features[i] == group and self.labels[i] == 1)
-            group_equal_opportunity[group] = true_positives / total_actual_positives if total_actual_positives > 0 else 0
-
-        return max(group_equal_opportunity.values()) - min(group_equal_opportunity.values())
+        return _spread(self._true_positive_rates())
 
- def compute_well_calibration(self):
-        """Calculate well calibration for protected groups."""
-        unique_groups = set(self.sensitive_features)
-        group_calibration = {}
-
-        for group in unique_groups:
-            predicted_probabilities = [self.predictions[i] for i in range(len(self.sensitive_features)) if self.sensitive_features[i] == group]
-            actuals = [self.labels[i] for i in range(len(self.sensitive_features)) if self.sensitive_features[i] == group]
+ @instrumented('fairness.well_calibration')
+ def compute_well_calibration(self, scores=None, n_bins=10, strategy='uniform'):
+        """
+        Calculate well calibration for protected groups.
 
-            # Simple calibration check
-            group_calibration[group] = abs(sum(predicted_probabilities) / len(predicted_probabilities) - sum(actuals) / len(actuals)) if len(predicted_probabilities) > 0 else 0
+        Without scores, compares the mean prediction with the mean label of each group. With
+        predicted probabilities, returns the max-min spread of the per-group expected calibration
+        error (see compute_calibration_by_group).
+        """
+        if scores is not None:
+            return _spread(self.compute_calibration_by_group(scores, n_bins, strategy)["ece"])
+        totals = self._group_totals()
+        mean_predictions = _ratio(self._require_sums(self.prediction_sums, "predictions"), totals)
+        mean_labels = _ratio(self._require_sums(self.label_sums, "labels"), totals)
 
-        return max(group_calibration.values()) - min(group_calibration.values())
+        # Simple calibration check
+        return _spread(np.abs(mean_predictions - mean_labels))
 
+ @instrumented('fairness.balance_for_positive_class')
  def compute_balance_for_positive_class(self):
         """Calculate balance for positive class for protected groups."""
-        unique_groups = set(self.sensitive_features)
-        group_balance = {}
-
-        for group in unique_groups:
-            expected_positive = sum(1 for i in range(len(self.sensitive_features)) 
-                                    if self.sensitive_features[i] == group and self.labels[i] == 1)
-            total_positive = sum(1 for i in range(len(self.sensitive_features)) 
-                                 if self.labels[i] == 1)
-            group_balance[group] = expected_positive / total_positive if total_positive > 0 else 0
-
-        return max(group_balance.values()) - min(group_balance.values())
+        expected_positive = self._actual_positives()
+        total_positive = expected_positive.sum(axis=-1, keepdims=True)
+        return _spread(_ratio(expected_positive, total_positive))
 
+ @instrumented('fairness.balance_for_negative_class')
  def compute_balance_for_negative_class(self):
         """Calculate balance for negative class for protected groups."""
-        unique_groups = set(self.sensitive_features)
-        group_balance = {}
+        expected_negative = self._actual_negatives()
+        total_negative = expected_negative.sum(axis=-1, keepdims=True)
+        return _spread(_ratio(expected_negative, total_negative))
+
+        def summuary_metrics_explanation():
+             print("")
 
-        for group in unique_groups:
-            expected_negative = sum(1 for i in range(len(self.sensitive_features)) 
-                                    if self.sensitive_features[i] == group and self.labels[i] == 0)
-            total_negative = sum(1 for i in range(len(self.sensitive_features)) 
-                                 if self.labels[i] == 0)
-            group_balance[group] = expected_negative / total_negative if total_negative > 0 else 0
+ @instrumented('fairness.bootstrap')
+ def bootstrap(self, n_resamples=1000, confidence=0.95, method='multinomial', seed=None):
+        """
+        Intervalli di confidenza bootstrap per tutte le metriche di fairness.
+
+        Il ricampionamento avviene sui conteggi aggregati per gruppo: per ogni gruppo si estraggono
+        i conteggi delle 9 celle (etichetta x predizione) con pesi multinomiali (ricampionamento
+        stratificato, la numerosità del gruppo resta fissa) oppure di Poisson. Il costo non dipende
+        quindi dal numero di righe. Per i valori diversi da 0 e 1 si usa la loro media nel gruppo.
+
+        :param n_resamples: numero di ricampionamenti B
+        :param confidence: livello di confidenza degli intervalli
+        :param method: 'multinomial' oppure 'poisson'
+        :param seed: seed, SeedSequence o Generator numpy
+        :return: dizionario metrica -> {"estimate", "std", "lower", "upper"} (con la stessa
+                 struttura del risultato della metrica per tuple e dizionari)
+        """
+        if self.counts.ndim != 3:
+            raise ValueError("Bootstrap requires unbatched counts")
+        rng = np.random.default_rng(seed)
+        n_groups = len(self.groups)
+        cells = self.counts.reshape(n_groups, N_OUTCOMES ** 2)
+        totals = cells.sum(axis=1)
+
+        if method == 'multinomial':
+            probabilities = np.where(totals[:, None] > 0, cells / np.maximum(totals, 1)[:, None],
+                                     1 / N_OUTCOMES ** 2)
+            resampled = rng.multinomial(totals, probabilities, size=(n_resamples, n_groups))
+        elif method == 'poisson':
+            resampled = rng.poisson(cells, size=(n_resamples, n_groups, N_OUTCOMES ** 2))
+        else:
+            raise ValueError("Invalid bootstrap method")
+        resampled = resampled.reshape(n_resamples, n_groups, N_OUTCOMES, N_OUTCOMES)
+
+        # Le celle OTHER portano la media per gruppo dei valori diversi da 0 e 1
+        other_correct = _ratio(self.correct - self.counts[:, NEGATIVE, NEGATIVE] - self.counts[:, POSITIVE, POSITIVE],
+                               self.counts[:, OTHER, OTHER])
+        correct = (resampled[..., NEGATIVE, NEGATIVE] + resampled[..., POSITIVE, POSITIVE]
+                   + resampled[..., OTHER, OTHER] * other_correct)
+        prediction_sums = label_sums = None
+        if self.prediction_sums is not None:
+            predicted = self.counts.sum(axis=1)
+            other_prediction = _ratio(self.prediction_sums - predicted[:, POSITIVE], predicted[:, OTHER])
+            predicted_resampled = resampled.sum(axis=-2)
+            prediction_sums = predicted_resampled[..., POSITIVE] + predicted_resampled[..., OTHER] * other_prediction
+        if self.label_sums is not None:
+            actual = self.counts.sum(axis=2)
+            other_label = _ratio(self.label_sums - actual[:, POSITIVE], actual[:, OTHER])
+            actual_resampled = resampled.sum(axis=-1)
+            label_sums = actual_resampled[..., POSITIVE] + actual_resampled[..., OTHER] * other_label
+
+        replicas = FairnessMetrics.from_counts(self.groups, resampled, correct, prediction_sums, label_sums)
+        intervals = {}
+        for name in METRIC_METHODS:
+            try:
+                estimate = getattr(self, name)()
+            except TypeError:
+                continue  # metrica che richiede valori numerici non disponibili
+            intervals[name[len("compute_"):]] = _interval(estimate, getattr(replicas, name)(), confidence)
+        return intervals
+
+ def _require_rows(self):
+        if self.group_codes is None:
+            raise ValueError("This metric needs row-level data, not aggregated counts")
+
+ @instrumented('fairness.threshold_curves')
+ def compute_threshold_curves(self, scores, thresholds=None):
+        """
+        Calcola accuratezza e tassi per gruppo (TPR, FPR, tasso di positivi, PPV) per ogni soglia
+        applicata ai punteggi del modello (es. predict_proba), con predizione positiva se score >= soglia.
 
-        return max(group_balance.values()) - min(group_balance.values())
+        Ogni riga riceve l'indice della prima soglia (in ordine decrescente) a cui diventa positiva;
+        un solo ordinamento per (gruppo, indice) e le somme cumulative danno i conteggi di tutte le
+        coppie (gruppo, soglia), per un costo O(n log n) complessivo.
 
-        def summuary_metrics_explanation():
-             print("")
\ No newline at end of file
+        :param scores: punteggi del modello, uno per riga
+        :param thresholds: soglie da valutare (default: tutti i valori distinti dei punteggi)
+        :return: dizionario con le soglie (decrescenti), i gruppi, le matrici (gruppi x soglie) dei
+                 tassi, l'accuratezza complessiva e le differenze max-min tra gruppi per ogni soglia
+        """
+        self._require_rows()
+        scores = np.asarray(scores, dtype=float)
+        labels = outcome_codes(self.labels)
+        if thresholds is None:
+            thresholds = np.unique(scores)
+        ascending = np.unique(np.asarray(thresholds, dtype=float))
+        n_thresholds, n_groups = len(ascending), len(self.groups)
+
+        # Indice (tra le soglie decrescenti) da cui la riga viene predetta positiva; n_thresholds = mai
+        entry = n_thresholds - np.searchsorted(ascending, scores, side='right')
+        rows = self.group_codes >= 0
+        keys = self.group_codes[rows].astype(np.intp) * (n_thresholds + 1) + entry[rows]
+        order = np.argsort(keys, kind='stable')
+        sorted_keys = keys[order]
+        sorted_labels = labels[rows][order]
+        cumulative_positive = np.concatenate([[0], np.cumsum(sorted_labels == POSITIVE)])
+        cumulative_negative = np.concatenate([[0], np.cumsum(sorted_labels == NEGATIVE)])
+
+        # Posizioni di inizio gruppo e di fine di ogni prefisso (gruppo, soglia) nell'ordinamento
+        group_starts = np.searchsorted(sorted_keys, np.arange(n_groups) * (n_thresholds + 1))
+        queries = np.arange(n_groups)[:, None] * (n_thresholds + 1) + np.arange(n_thresholds)[None, :]
+        prefix_ends = np.searchsorted(sorted_keys, queries, side='right')
+        predicted_positive = prefix_ends - group_starts[:, None]
+        true_positives = cumulative_positive[prefix_ends] - cumulative_positive[group_starts][:, None]
+        false_positives = cumulative_negative[prefix_ends] - cumulative_negative[group_starts][:, None]
+
+        totals = self._group_totals()
+        actual_positives = self._actual_positives()
+        actual_negatives = self._actual_negatives()
+        tpr = _ratio(true_positives, actual_positives[:, None])
+        fpr = _ratio(false_positives, actual_negatives[:, None])
+        positive_rate = _ratio(predicted_positive, totals[:, None])
+        ppv = _ratio(true_positives, predicted_positive)
+
+        # Accuratezza binaria: (tp + tn) / (righe con etichetta 0 o 1)
+        true_negatives = actual_negatives.sum() - false_positives.sum(axis=0)
+        accuracy = _ratio(true_positives.sum(axis=0) + true_negatives, actual_positives.sum() + actual_negatives.sum())
+        return {
+            "thresholds": ascending[::-1],
+            "groups": self.group_names,
+            "accuracy": accuracy,
+            "tpr": tpr,
+            "fpr": fpr,
+            "positive_rate": positive_rate,
+            "ppv": ppv,
+            "demographic_parity": positive_rate.max(axis=0) - positive_rate.min(axis=0),
+            "equal_opportunity": tpr.max(axis=0) - tpr.min(axis=0),
+            "false_positive_parity": fpr.max(axis=0) - fpr.min(axis=0),
+            "predictive_parity": ppv.max(axis=0) - ppv.min(axis=0),
+        }
+
+ @instrumented('fairness.calibration_by_group')
+ def compute_calibration_by_group(self, scores, n_bins=10, strategy='uniform'):
+        """
+        Curva di affidabilità (reliability diagram) ed errori di calibrazione per gruppo.
+
+        I punteggi vengono assegnati ai bin con un solo np.digitize e i conteggi per (gruppo, bin)
+        sono ottenuti con bincount bidimensionali, senza passaggi separati per ogni gruppo.
+
+        :param scores: probabilità predette della classe positiva, una per riga
+        :param n_bins: numero di bin
+        :param strategy: 'uniform' (bin di uguale ampiezza in [0, 1]) oppure 'quantile'
+                         (bin con lo stesso numero di punteggi)
+        :return: dizionario con gli estremi dei bin, i gruppi, ECE e MCE per gruppo, la tabella di
+                 affidabilità (conteggi, punteggio medio e frequenza di positivi per gruppo x bin)
+                 e le differenze max-min di ECE e MCE tra i gruppi
+        """
+        self._require_rows()
+        scores = np.asarray(scores, dtype=float)
+        if strategy == 'uniform':
+            edges = np.linspace(0.0, 1.0, n_bins + 1)
+        elif strategy == 'quantile':
+            edges = np.unique(np.quantile(scores, np.linspace(0.0, 1.0, n_bins + 1)))
+        else:
+            raise ValueError("Invalid strategy")
+        n_bins = max(len(edges) - 1, 1)
+        bins = np.clip(np.digitize(scores, edges[1:-1]), 0, n_bins - 1)
+
+        rows = self.group_codes >= 0
+        n_groups = len(self.groups)
+        cells = self.group_codes[rows].astype(np.intp) * n_bins + bins[rows]
+        size = n_groups * n_bins
+        counts = np.bincount(cells, minlength=size).reshape(n_groups, n_bins)
+        score_sums = np.bincount(cells, weights=scores[rows], minlength=size).reshape(n_groups, n_bins)
+        positive_sums = np.bincount(cells, weights=outcome_codes(self.labels)[rows] == POSITIVE,
+                                    minlength=size).reshape(n_groups, n_bins)
+
+        mean_score = _ratio(score_sums, counts)
+        positive_rate = _ratio(positive_sums, counts)
+        gaps = np.abs(mean_score - positive_rate)
+        ece = (_ratio(counts, counts.sum(axis=1, keepdims=True)) * gaps).sum(axis=1)
+        mce = np.where(counts > 0, gaps, 0.0).max(axis=1)
+        return {
+            "bin_edges": edges,
+            "groups": self.group_names,
+            "ece": ece,
+            "mce": mce,
+            "counts": counts,
+            "mean_score": mean_score,
+            "positive_rate": positive_rate,
+            "ece_gap": _spread(ece),
+            "mce_gap": _spread(mce),
+        }
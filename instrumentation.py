@@ -0,0 +1,176 @@
+import contextlib
+import functools
+import threading
+import time
+import tracemalloc
+import warnings
+
+# tracemalloc è globale per il processo: stato condiviso dalle fasi che misurano la memoria
+_memory_lock = threading.Lock()
+# Numero di fasi con misura della memoria attive per thread
+_memory_depth = {}
+# Incrementato ogni volta che fasi con misura della memoria si sovrappongono tra thread diversi
+_memory_generation = 0
+# True se il tracciamento è stato avviato da una fase (e va quindi fermato alla fine dell'ultima)
+_started_tracing = False
+
+
+def _enter_memory_stage():
+    """Registra l'inizio di una fase con misura della memoria; restituisce la generazione corrente."""
+    global _memory_generation, _started_tracing
+    thread = threading.get_ident()
+    with _memory_lock:
+        if not _memory_depth and not tracemalloc.is_tracing():
+            tracemalloc.start()
+            _started_tracing = True
+        _memory_depth[thread] = _memory_depth.get(thread, 0) + 1
+        if len(_memory_depth) > 1:
+            # Un altro thread sta misurando: i picchi di entrambi non sono più attribuibili
+            _memory_generation += 1
+        return _memory_generation
+
+
+def _exit_memory_stage():
+    global _started_tracing
+    thread = threading.get_ident()
+    with _memory_lock:
+        _memory_depth[thread] -= 1
+        if not _memory_depth[thread]:
+            del _memory_depth[thread]
+        if not _memory_depth and _started_tracing:
+            tracemalloc.stop()
+            _started_tracing = False
+
+
+class Instrumentation:
+    def __init__(self, track_memory=False, hooks=None):
+        """
+        Raccoglie tempo, numero di chiamate e (opzionalmente) picco di memoria per ogni fase.
+
+        Le fasi annidate ereditano i tag della fase che le contiene (es. epsilon di uno sweep),
+        così le metriche calcolate dentro un punto della griglia sono riportate per quell'epsilon.
+
+        :param track_memory: se True misura il picco di memoria allocata con tracemalloc, attivo solo
+                             mentre una fase è in corso; tracemalloc è unico per il processo, quindi
+                             le fasi che si sovrappongono a fasi misurate in altri thread (es. sweep
+                             con backend='thread') riportano peak_bytes None
+        :param hooks: funzioni chiamate con un dizionario (stage, tags, time, peak_bytes) alla
+                      fine di ogni fase, ad esempio per inoltrare le misure a un exporter esterno;
+                      le eccezioni di un hook diventano warning e non interrompono il codice misurato
+        """
+        self.track_memory = track_memory
+        self.hooks = list(hooks or [])
+        self.stats = {}
+        self._lock = threading.Lock()
+        self._local = threading.local()
+
+    def add_hook(self, callback):
+        """Registra una funzione chiamata alla fine di ogni fase."""
+        self.hooks.append(callback)
+
+    def _frames(self):
+        if not hasattr(self._local, 'frames'):
+            self._local.frames = []
+        return self._local.frames
+
+    @contextlib.contextmanager
+    def stage(self, name, **tags):
+        """
+        Misura il blocco di codice come fase `name`.
+
+        :param name: nome della fase (es. 'fairness.confusion_counts')
+        :param tags: attributi aggiuntivi della misura (es. epsilon=0.5)
+        """
+        frames = self._frames()
+        if frames:
+            tags = {**frames[-1]["tags"], **tags}
+        frame = {"tags": tags}
+        if self.track_memory:
+            frame["generation"] = _enter_memory_stage()
+            current, peak = tracemalloc.get_traced_memory()
+            if frames and "peak" in frames[-1]:
+                frames[-1]["peak"] = max(frames[-1]["peak"], peak)
+            tracemalloc.reset_peak()
+            frame["start_memory"] = frame["peak"] = current
+        frames.append(frame)
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            elapsed = time.perf_counter() - start
+            frames.pop()
+            peak_bytes = None
+            if self.track_memory:
+                frame["peak"] = max(frame["peak"], tracemalloc.get_traced_memory()[1])
+                if frames and "peak" in frames[-1]:
+                    frames[-1]["peak"] = max(frames[-1]["peak"], frame["peak"])
+                with _memory_lock:
+                    overlapped = frame["generation"] != _memory_generation or len(_memory_depth) > 1
+                if not overlapped:
+                    peak_bytes = frame["peak"] - frame["start_memory"]
+                _exit_memory_stage()
+            self._record(name, tags, elapsed, peak_bytes)
+
+    def _record(self, name, tags, elapsed, peak_bytes):
+        key = (name, tuple(sorted(tags.items())))
+        with self._lock:
+            stats = self.stats.setdefault(key, {"calls": 0, "total_time": 0.0, "max_time": 0.0,
+                                                "peak_bytes": None})
+            stats["calls"] += 1
+            stats["total_time"] += elapsed
+            stats["max_time"] = max(stats["max_time"], elapsed)
+            if peak_bytes is not None:
+                stats["peak_bytes"] = max(stats["peak_bytes"] or 0, peak_bytes)
+        if self.hooks:
+            record = {"stage": name, "tags": tags, "time": elapsed, "peak_bytes": peak_bytes}
+            for hook in self.hooks:
+                try:
+                    hook(record)
+                except Exception as error:
+                    # Un exporter difettoso non deve mascherare né causare errori dell'audit
+                    warnings.warn(f"Instrumentation hook {hook!r} failed: {error!r}", RuntimeWarning)
+
+    def report(self):
+        """
+        Restituisce le misure aggregate per (fase, tag), ordinate per tempo totale decrescente.
+
+        :return: lista di dizionari con stage, tags, calls, total_time, mean_time, max_time, peak_bytes
+        """
+        with self._lock:
+            items = list(self.stats.items())
+        report = [{"stage": name, "tags": dict(tags), "calls": stats["calls"], "total_time": stats["total_time"],
+                   "mean_time": stats["total_time"] / stats["calls"], "max_time": stats["max_time"],
+                   "peak_bytes": stats["peak_bytes"]}
+                  for (name, tags), stats in items]
+        return sorted(report, key=lambda entry: entry["total_time"], reverse=True)
+
+    def reset(self):
+        """Azzera le misure raccolte."""
+        with self._lock:
+            self.stats.clear()
+
+
+class _NullInstrumentation:
+    """Strumentazione disattivata: ogni fase è un contesto vuoto condiviso."""
+
+    _context = contextlib.nullcontext()
+
+    def stage(self, name, **tags):
+        return self._context
+
+    def report(self):
+        return []
+
+
+NULL_INSTRUMENTATION = _NullInstrumentation()
+
+
+def instrumented(name):
+    """Decoratore per metodi di classi con attributo `instrumentation`: misura il metodo come fase `name`."""
+    def decorator(method):
+        @functools.wraps(method)
+        def wrapper(self, *args, **kwargs):
+            with self.instrumentation.stage(name):
+                return method(self, *args, **kwargs)
+        return wrapper
+    return decorator
@@ -0,0 +1,108 @@
+import numpy as np
+from fairness_metrics import FairnessMetrics, N_OUTCOMES, NEGATIVE, POSITIVE, grouped_confusion
+from model_evaluator import ModelEvaluator
+from utilities import Utilities
+
+
+class MetricsAccumulator:
+    def __init__(self):
+        """
+        Accumula in modo incrementale i conteggi per gruppo necessari a FairnessMetrics e
+        ModelEvaluator, senza conservare le singole predizioni.
+
+        Lo stato ha dimensione proporzionale al numero di gruppi osservati: i dati possono
+        arrivare a lotti con update() e stati parziali possono essere combinati con merge().
+        """
+        self.group_index = {}
+        self.groups = []
+        self.counts = np.zeros((0, N_OUTCOMES, N_OUTCOMES), dtype=np.int64)
+        self.correct = np.zeros(0)
+        self.prediction_sums = np.zeros(0)
+        self.label_sums = np.zeros(0)
+        self.n_rows = 0
+
+    def _group_positions(self, groups):
+        """Restituisce la posizione di ciascun gruppo nello stato, aggiungendo quelli nuovi."""
+        positions = []
+        for group in groups:
+            group = Utilities.convert_to_native(group)
+            if group not in self.group_index:
+                self.group_index[group] = len(self.groups)
+                self.groups.append(group)
+            positions.append(self.group_index[group])
+
+        # Estende gli array dello stato per i gruppi appena osservati
+        missing = len(self.groups) - len(self.counts)
+        if missing > 0:
+            self.counts = np.concatenate([self.counts, np.zeros((missing, N_OUTCOMES, N_OUTCOMES), dtype=np.int64)])
+            self.correct = np.concatenate([self.correct, np.zeros(missing)])
+            if self.prediction_sums is not None:
+                self.prediction_sums = np.concatenate([self.prediction_sums, np.zeros(missing)])
+            if self.label_sums is not None:
+                self.label_sums = np.concatenate([self.label_sums, np.zeros(missing)])
+        return np.asarray(positions, dtype=np.intp)
+
+    def _add(self, positions, counts, correct, prediction_sums, label_sums):
+        self.counts[positions] += counts.astype(np.int64)
+        self.correct[positions] += correct
+        # Le somme restano disponibili solo finché tutti i lotti sono numerici
+        if self.prediction_sums is not None and prediction_sums is not None:
+            self.prediction_sums[positions] += prediction_sums
+        else:
+            self.prediction_sums = None
+        if self.label_sums is not None and label_sums is not None:
+            self.label_sums[positions] += label_sums
+        else:
+            self.label_sums = None
+
+    def update(self, predictions, labels, groups):
+        """
+        Aggiunge un lotto di predizioni allo stato.
+
+        :param predictions: predizioni del modello per il lotto
+        :param labels: etichette reali per il lotto
+        :param groups: valori della feature sensibile per il lotto (o tabella di più feature,
+                       nel qual caso i gruppi sono le loro intersezioni)
+        :return: l'accumulatore stesso
+        """
+        batch_groups, group_codes = Utilities.factorize_groups(groups)
+        if len(group_codes) == 0:
+            return self
+        positions = self._group_positions(batch_groups)
+        self._add(positions, *grouped_confusion(group_codes, len(batch_groups), labels, predictions))
+        self.n_rows += len(group_codes)
+        return self
+
+    def merge(self, other):
+        """
+        Combina nello stato corrente lo stato di un altro accumulatore.
+
+        :param other: istanza di MetricsAccumulator
+        :return: l'accumulatore stesso
+        """
+        positions = self._group_positions(other.groups)
+        self._add(positions, other.counts, other.correct, other.prediction_sums, other.label_sums)
+        self.n_rows += other.n_rows
+        return self
+
+    def _sorted_order(self):
+        try:
+            return sorted(range(len(self.groups)), key=lambda i: self.groups[i])
+        except TypeError:
+            return list(range(len(self.groups)))
+
+    def fairness_metrics(self):
+        """Restituisce un FairnessMetrics calcolato sui conteggi accumulati finora."""
+        order = self._sorted_order()
+        groups = np.empty(len(order), dtype=object)
+        groups[:] = [self.groups[i] for i in order]
+        return FairnessMetrics.from_counts(
+            groups, self.counts[order], self.correct[order],
+            None if self.prediction_sums is None else self.prediction_sums[order],
+            None if self.label_sums is None else self.label_sums[order])
+
+    def model_evaluator(self):
+        """Restituisce un ModelEvaluator calcolato sui conteggi accumulati finora."""
+        totals = self.counts.sum(axis=0)
+        return ModelEvaluator.from_counts(tp=totals[POSITIVE, POSITIVE], fp=totals[NEGATIVE, POSITIVE],
+                                          fn=totals[POSITIVE, NEGATIVE], tn=totals[NEGATIVE, NEGATIVE])
@@ -1,54 +1,238 @@
+import numpy as np
+from instrumentation import NULL_INSTRUMENTATION, instrumented
+from utilities import Utilities
+
+
+def _encode_predictions(classes, y_pred):
+    """
+    Converte le predizioni nell'indice della classe corrispondente; le predizioni che non
+    coincidono con nessuna classe ricevono l'indice len(classes).
+    """
+    n_classes = len(classes)
+    if classes.dtype != object:
+        try:
+            positions = np.searchsorted(classes, y_pred)
+            matched = classes[np.minimum(positions, n_classes - 1)] == y_pred
+            return np.where(matched & (positions < n_classes), positions, n_classes)
+        except TypeError:
+            pass
+    # Tipi non confrontabili: corrispondenza tramite dizionario sui valori unici
+    index = {Utilities.convert_to_native(c): i for i, c in enumerate(classes)}
+    uniques, codes = Utilities.factorize(y_pred)
+    lookup = np.array([index.get(Utilities.convert_to_native(u), n_classes) for u in uniques], dtype=np.intp)
+    return lookup[codes].reshape(np.shape(y_pred))
+
+
+def encode_labels(y_true):
+    """
+    Ricava le classi dalle etichette vere (etichette 0/1 => caso binario con classi [0, 1]).
+
+    :param y_true: valori veri
+    :return: tupla (classes, true_codes)
+    """
+    y_true = np.asarray(y_true)
+    classes, true_codes = Utilities.factorize(y_true)
+    if all(c in (0, 1) for c in classes.tolist()):
+        # Caso binario: le classi sono sempre 0 e 1, come nella definizione di tp/fp/fn/tn
+        classes = np.array([0, 1])
+        true_codes = np.empty(len(y_true), dtype=np.uint8)
+        for block in Utilities.row_blocks(len(y_true)):
+            true_codes[block] = _encode_predictions(classes, y_true[block])
+    return classes, true_codes
+
+
+def confusion_matrices(classes, true_codes, y_pred):
+    """
+    Calcola con bincount vettoriali le matrici di confusione (modelli x classe vera x classe predetta),
+    elaborando le righe a blocchi per non convertire per intero input compatti o memory-mapped.
+
+    :param classes: classi restituite da encode_labels
+    :param true_codes: codici delle etichette vere restituiti da encode_labels
+    :param y_pred: predizioni, shape (n,) oppure (modelli, n)
+    :return: array (..., K, K + 1)
+    """
+    y_pred = np.asarray(y_pred)
+    n_classes = len(classes)
+    n_models = 1 if y_pred.ndim == 1 else y_pred.shape[0]
+    model_offsets = (np.arange(n_models) * n_classes).reshape((-1, 1)) if y_pred.ndim > 1 else 0
+
+    matrices = np.zeros(n_models * n_classes * (n_classes + 1), dtype=np.int64)
+    for block in Utilities.row_blocks(y_pred.shape[-1]):
+        pred_codes = _encode_predictions(classes, y_pred[..., block])
+        flat = ((true_codes[block].astype(np.intp) + model_offsets) * (n_classes + 1) + pred_codes).ravel()
+        matrices += np.bincount(flat, minlength=len(matrices))
+    return matrices.reshape(y_pred.shape[:-1] + (n_classes, n_classes + 1))
+
+
+# Divisione che restituisce 0 dove il denominatore è nullo
+_ratio = Utilities.safe_divide
+
+
 class ModelEvaluator:
-    def __init__(self, y_true, y_pred):
+    def __init__(self, y_true, y_pred, instrumentation=None):
         """
         Inizializza la classe con i valori veri e i valori predetti.
 
+        Le classi sono ricavate da y_true (etichette 0/1 => caso binario) e le matrici di
+        confusione di tutti i modelli sono calcolate con un unico bincount vettoriale.
+
         :param y_true: valori veri
-        :param y_pred: valori predetti
+        :param y_pred: valori predetti, oppure matrice (modelli x n) con le predizioni di più modelli
+        :param instrumentation: Instrumentation che misura tempi e memoria delle singole fasi
         """
+        self.instrumentation = instrumentation or NULL_INSTRUMENTATION
         self.y_true = y_true
         self.y_pred = y_pred
-        self.tp = 0  # True Positives
-        self.fp = 0  # False Positives
-        self.fn = 0  # False Negatives
-        self.tn = 0  # True Negatives
-        self._calculate_confusion_matrix()
+        with self.instrumentation.stage('evaluator.confusion_matrix'):
+            self._calculate_confusion_matrix()
+
+    @classmethod
+    def from_confusion(cls, matrices, classes, instrumentation=None):
+        """
+        Costruisce il valutatore da matrici di confusione già calcolate.
+
+        :param matrices: array (K, K + 1) oppure (modelli, K, K + 1) indicizzato per
+                         [classe vera, classe predetta]; l'ultima colonna conta le predizioni
+                         che non corrispondono a nessuna classe
+        :param classes: valori delle K classi
+        :param instrumentation: Instrumentation che misura tempi e memoria delle singole fasi
+        """
+        evaluator = cls.__new__(cls)
+        evaluator.instrumentation = instrumentation or NULL_INSTRUMENTATION
+        evaluator.y_true = evaluator.y_pred = None
+        evaluator._set_matrices(np.asarray(matrices), np.asarray(classes))
+        return evaluator
+
+    @classmethod
+    def from_counts(cls, tp, fp, fn, tn):
+        """
+        Costruisce il valutatore direttamente dai valori della matrice di confusione.
+
+        :param tp: True Positives
+        :param fp: False Positives
+        :param fn: False Negatives
+        :param tn: True Negatives
+        """
+        return cls.from_confusion([[tn, fp, 0], [fn, tp, 0]], [0, 1])
+
+    @classmethod
+    def from_dataset(cls, dataset, y_pred, instrumentation=None, n_jobs=1):
+        """
+        Costruisce il valutatore per le predizioni di un modello su un EncodedDataset,
+        riutilizzando le classi e i codici delle etichette già calcolati.
+
+        :param dataset: EncodedDataset con le etichette vere
+        :param y_pred: valori predetti, oppure matrice (modelli x n)
+        :param instrumentation: Instrumentation che misura tempi e memoria delle singole fasi
+        :param n_jobs: numero di processi tra cui suddividere le righe per il conteggio
+        """
+        evaluator = cls.__new__(cls)
+        evaluator.instrumentation = instrumentation or NULL_INSTRUMENTATION
+        evaluator.y_true = dataset.labels
+        evaluator.y_pred = y_pred
+        with evaluator.instrumentation.stage('evaluator.confusion_matrix'):
+            evaluator._set_matrices(dataset.confusion_matrices(y_pred, n_jobs), dataset.classes)
+        return evaluator
 
     def _calculate_confusion_matrix(self):
-        """Calcola manualmente i valori della matrice di confusione (tp, fp, fn, tn)."""
-        for true, pred in zip(self.y_true, self.y_pred):
-            if true == 1 and pred == 1:
-                self.tp += 1
-            elif true == 0 and pred == 1:
-                self.fp += 1
-            elif true == 1 and pred == 0:
-                self.fn += 1
-            elif true == 0 and pred == 0:
-                self.tn += 1
+        """Calcola le matrici di confusione (modelli x classe vera x classe predetta)."""
+        classes, true_codes = encode_labels(self.y_true)
+        self._set_matrices(confusion_matrices(classes, true_codes, self.y_pred), classes)
+
+    def _set_matrices(self, matrices, classes):
+        self.matrices = matrices
+        self.classes = classes
+        self.binary = len(classes) == 2 and all(c in (0, 1) for c in classes.tolist())
+        if self.binary:
+            self.tn = self._scalar(matrices[..., 0, 0])  # True Negatives
+            self.fp = self._scalar(matrices[..., 0, 1])  # False Positives
+            self.fn = self._scalar(matrices[..., 1, 0])  # False Negatives
+            self.tp = self._scalar(matrices[..., 1, 1])  # True Positives
+
+    def _scalar(self, value):
+        """Converte i risultati in tipi Python per un singolo modello, array per più modelli."""
+        if np.ndim(value) == 0:
+            return np.asarray(value).item()
+        return value
+
+    def _per_class(self):
+        """Veri positivi, predizioni e osservazioni per ciascuna classe (ultimo asse)."""
+        classes = np.arange(len(self.classes))
+        true_positives = self.matrices[..., classes, classes]
+        predicted = self.matrices[..., :len(classes)].sum(axis=-2)
+        actual = self.matrices.sum(axis=-1)
+        return true_positives, predicted, actual
+
+    def _resolve_average(self, average):
+        if average is None:
+            return 'binary' if self.binary else 'macro'
+        if average == 'binary' and not self.binary:
+            raise ValueError("average='binary' requires binary labels")
+        if average not in ('binary', 'macro', 'micro'):
+            raise ValueError("Invalid average")
+        return average
 
     def accuracy(self):
         """Calcola l'accuratezza del modello."""
-        total = self.tp + self.fp + self.fn + self.tn
-        return (self.tp + self.tn) / total if total else 0
+        if self.binary:
+            total = self.tp + self.fp + self.fn + self.tn
+            return self._scalar(_ratio(self.tp + self.tn, total))
+        true_positives, _, actual = self._per_class()
+        return self._scalar(_ratio(true_positives.sum(axis=-1), actual.sum(axis=-1)))
 
-    def precision(self):
-        """Calcola la precisione del modello."""
-        return self.tp / (self.tp + self.fp) if (self.tp + self.fp) else 0
+    def precision(self, average=None):
+        """
+        Calcola la precisione del modello.
 
-    def recall(self):
-        """Calcola il richiamo del modello."""
-        return self.tp / (self.tp + self.fn) if (self.tp + self.fn) else 0
+        :param average: 'binary' (classe positiva 1), 'macro' o 'micro'; di default 'binary' per
+                        etichette 0/1 e 'macro' altrimenti
+        """
+        average = self._resolve_average(average)
+        if average == 'binary':
+            return self._scalar(_ratio(self.tp, self.tp + self.fp))
+        true_positives, predicted, _ = self._per_class()
+        if average == 'micro':
+            return self._scalar(_ratio(true_positives.sum(axis=-1), predicted.sum(axis=-1)))
+        return self._scalar(_ratio(true_positives, predicted).mean(axis=-1))
 
-    def f1(self):
-        """Calcola l'F1 score del modello."""
-        precision = self.precision()
-        recall = self.recall()
-        return (2 * precision * recall) / (precision + recall) if (precision + recall) else 0
+    def recall(self, average=None):
+        """
+        Calcola il richiamo del modello.
+
+        :param average: 'binary' (classe positiva 1), 'macro' o 'micro'
+        """
+        average = self._resolve_average(average)
+        if average == 'binary':
+            return self._scalar(_ratio(self.tp, self.tp + self.fn))
+        true_positives, _, actual = self._per_class()
+        if average == 'micro':
+            return self._scalar(_ratio(true_positives.sum(axis=-1), actual.sum(axis=-1)))
+        return self._scalar(_ratio(true_positives, actual).mean(axis=-1))
+
+    def f1(self, average=None):
+        """
+        Calcola l'F1 score del modello.
+
+        :param average: 'binary' (classe positiva 1), 'macro' (media degli F1 per classe) o 'micro'
+        """
+        average = self._resolve_average(average)
+        if average == 'macro':
+            true_positives, predicted, actual = self._per_class()
+            precision, recall = _ratio(true_positives, predicted), _ratio(true_positives, actual)
+            return self._scalar(_ratio(2 * precision * recall, precision + recall).mean(axis=-1))
+        precision = np.asarray(self.precision(average))
+        recall = np.asarray(self.recall(average))
+        return self._scalar(_ratio(2 * precision * recall, precision + recall))
 
     def confusion_matrix(self):
-        """Restituisce la matrice di confusione come una lista di liste."""
-        return [[self.tn, self.fp], [self.fn, self.tp]]
+        """Restituisce la matrice di confusione come una lista di liste (una per modello)."""
+        if self.binary:
+            return np.stack([np.stack([self.matrices[..., 0, 0], self.matrices[..., 0, 1]], axis=-1),
+                             np.stack([self.matrices[..., 1, 0], self.matrices[..., 1, 1]], axis=-1)],
+                            axis=-2).tolist()
+        return self.matrices[..., :len(self.classes)].tolist()
 
+    @instrumented('evaluator.summary')
     def summary(self):
         """Ritorna un dizionario con tutte le metriche calcolate."""
         return {
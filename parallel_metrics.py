@@ -0,0 +1,186 @@
+import os
+import threading
+import weakref
+from collections import OrderedDict
+import numpy as np
+from fairness_metrics import prediction_counts
+from model_evaluator import confusion_matrices
+from utilities import BLOCK_SIZE
+
+# Segmenti persistenti (SharedArray) già aperti dal processo worker, per nome, dal meno recente
+_attached = OrderedDict()
+# Numero massimo di segmenti persistenti tenuti aperti da ogni worker
+MAX_ATTACHED = 16
+# Pool di processi riutilizzati tra le chiamate, uno per numero di worker
+_pools = {}
+_pools_lock = threading.Lock()
+
+
+def _create_segment(array):
+    """Copia un array in un nuovo segmento di memoria condivisa e restituisce (segmento, descrizione)."""
+    from multiprocessing import shared_memory
+
+    array = np.ascontiguousarray(array)
+    segment = shared_memory.SharedMemory(create=True, size=max(array.nbytes, 1))
+    np.ndarray(array.shape, dtype=array.dtype, buffer=segment.buf)[...] = array
+    return segment, (segment.name, array.dtype.str, array.shape)
+
+
+def _release_segment(segment):
+    segment.close()
+    segment.unlink()
+
+
+class SharedArray:
+    def __init__(self, array):
+        """
+        Copia di un array in memoria condivisa, riusabile da più chiamate a sharded_map senza
+        essere copiata di nuovo (es. i codici invarianti di un EncodedDataset). Il segmento viene
+        rimosso con close() o quando l'oggetto viene raccolto dal garbage collector.
+
+        :param array: array numerico (non di oggetti Python)
+        """
+        array = np.asarray(array)
+        if array.dtype.hasobject:
+            raise ValueError("Arrays of Python objects cannot be shared")
+        segment, (name, dtype, shape) = _create_segment(array)
+        self.description = (name, dtype, shape, True)
+        self.array = np.ndarray(shape, dtype=np.dtype(dtype), buffer=segment.buf)
+        self._finalizer = weakref.finalize(self, _release_segment, segment)
+
+    def close(self):
+        """Rimuove il segmento condiviso."""
+        self.array = None
+        self._finalizer()
+
+
+def _attach(description):
+    """
+    Vista numpy, senza copia, di un array condiviso dal processo principale.
+
+    :return: tupla (array, segmento da chiudere dopo l'uso oppure None per i segmenti persistenti)
+    """
+    from multiprocessing import shared_memory
+
+    name, dtype, shape, persistent = description
+    if not persistent:
+        # I worker condividono il resource tracker del processo principale, che rimuove il segmento
+        segment = shared_memory.SharedMemory(name=name)
+        return np.ndarray(shape, dtype=np.dtype(dtype), buffer=segment.buf), segment
+    if name in _attached:
+        _attached.move_to_end(name)
+    else:
+        _attached[name] = shared_memory.SharedMemory(name=name)
+        while len(_attached) > MAX_ATTACHED:
+            _attached.popitem(last=False)[1].close()
+    return np.ndarray(shape, dtype=np.dtype(dtype), buffer=_attached[name].buf), None
+
+
+def _run_shard(function, descriptions, start, stop, args):
+    attached = [_attach(description) for description in descriptions]
+    arrays = [array[..., start:stop] for array, _ in attached]
+    result = function(*arrays, *args)
+    # Le viste vanno eliminate prima di chiudere i segmenti temporanei di questa chiamata
+    del arrays
+    segments = [segment for _, segment in attached if segment is not None]
+    del attached
+    for segment in segments:
+        segment.close()
+    return result
+
+
+def _pool(n_jobs):
+    """Pool di processi con n_jobs worker, creato alla prima richiesta e poi riutilizzato."""
+    # Import locale: il pool serve solo per il calcolo parallelo
+    from concurrent.futures import ProcessPoolExecutor
+
+    with _pools_lock:
+        if n_jobs not in _pools:
+            _pools[n_jobs] = ProcessPoolExecutor(max_workers=n_jobs)
+        return _pools[n_jobs]
+
+
+def shutdown_pools():
+    """Termina i pool di processi persistenti (vengono ricreati alla chiamata successiva)."""
+    with _pools_lock:
+        pools = list(_pools.values())
+        _pools.clear()
+    for pool in pools:
+        pool.shutdown()
+
+
+def sharded_map(function, arrays, args=(), n_jobs=None, shard_size=None):
+    """
+    Applica function a porzioni contigue di righe (ultimo asse) di tutti gli array su un pool di processi.
+
+    I worker leggono le porzioni dalla memoria condivisa senza serializzarle; si scambiano solo i
+    risultati parziali, da ridurre a cura del chiamante. Gli array passati come SharedArray sono già
+    condivisi e non vengono copiati; gli altri vengono copiati in segmenti temporanei rimossi al
+    termine della chiamata. Il pool di processi resta attivo tra una chiamata e l'altra.
+    Con n_jobs == 1 o con array di oggetti Python la funzione viene eseguita nel processo corrente.
+
+    :param function: funzione di livello modulo chiamata come function(*porzioni, *args)
+    :param arrays: array o SharedArray con lo stesso numero di righe sull'ultimo asse
+    :param args: argomenti aggiuntivi (piccoli) passati a ogni chiamata
+    :param n_jobs: numero di processi, almeno 1 (None o -1 usa tutti i core)
+    :param shard_size: righe per porzione (default: righe divise equamente tra i processi)
+    :return: lista dei risultati, uno per porzione, in ordine di riga
+    """
+    arrays = [array if isinstance(array, SharedArray) else np.asarray(array) for array in arrays]
+    local = [array.array if isinstance(array, SharedArray) else array for array in arrays]
+    n = local[0].shape[-1]
+    if n_jobs is None or n_jobs < 0:
+        n_jobs = os.cpu_count() or 1
+    elif n_jobs == 0:
+        raise ValueError("n_jobs must be positive, -1 or None")
+    if shard_size is None:
+        shard_size = max(BLOCK_SIZE, -(-n // n_jobs))
+    bounds = [(start, min(start + shard_size, n)) for start in range(0, n, shard_size)] or [(0, 0)]
+    if n_jobs == 1 or len(bounds) == 1 or any(array.dtype.hasobject for array in local):
+        return [function(*(array[..., start:stop] for array in local), *args) for start, stop in bounds]
+
+    segments = []
+    try:
+        descriptions = []
+        for array in arrays:
+            if isinstance(array, SharedArray):
+                descriptions.append(array.description)
+            else:
+                segment, description = _create_segment(array)
+                segments.append(segment)
+                descriptions.append(description + (False,))
+        executor = _pool(n_jobs)
+        futures = [executor.submit(_run_shard, function, descriptions, start, stop, args) for start, stop in bounds]
+        return [future.result() for future in futures]
+    finally:
+        for segment in segments:
+            _release_segment(segment)
+
+
+def _shard_prediction_counts(group_codes, cells, labels, predictions, n_groups):
+    return prediction_counts(group_codes, n_groups, cells, labels, predictions)
+
+
+def _shard_confusion_matrices(class_codes, predictions, classes):
+    return confusion_matrices(classes, class_codes, predictions)
+
+
+def parallel_prediction_counts(group_codes, n_groups, cells, labels, predictions, n_jobs=None, shard_size=None):
+    """
+    Equivale a prediction_counts, ma conta le porzioni di righe in parallelo e somma i conteggi parziali.
+    Gli array invarianti possono essere passati come SharedArray, così da non copiarli a ogni chiamata.
+
+    :return: tupla (counts, correct, prediction_sums)
+    """
+    partials = sharded_map(_shard_prediction_counts, [group_codes, cells, labels, predictions], (n_groups,),
+                           n_jobs, shard_size)
+    counts = sum(partial[0] for partial in partials)
+    correct = sum(partial[1] for partial in partials)
+    sums = [partial[2] for partial in partials]
+    prediction_sums = None if any(s is None for s in sums) else sum(sums)
+    return counts, correct, prediction_sums
+
+
+def parallel_confusion_matrices(classes, class_codes, y_pred, n_jobs=None, shard_size=None):
+    """Equivale a confusion_matrices, sommando le matrici calcolate in parallelo su porzioni di righe."""
+    return sum(sharded_map(_shard_confusion_matrices, [class_codes, y_pred], (classes,), n_jobs, shard_size))
@@ -1,123 +1,729 @@
+import math
+import os
+import numpy as np
 from differential_privacy import DifferentialPrivacy
-from fairness_metrics import FairnessMetrics
+from encoded_dataset import EncodedDataset
+from fairness_metrics import FairnessMetrics, expected_confusion
+from instrumentation import NULL_INSTRUMENTATION, instrumented
 from model_evaluator import ModelEvaluator
+from result_cache import make_key
 from utilities import Utilities
 
+# Griglia di epsilon usata quando non ne viene specificata una
+DEFAULT_EPSILON_VALUES = [0.1, 0.3, 0.7, 1.5, 2, 2.5, 3, 5, 7]
+# Numero massimo di elementi (trials x n) generati in un singolo blocco di rumore
+TRIAL_BLOCK_ELEMENTS = 1 << 24
+
 
 class Toolkit:
-    def __init__(self, predictions, labels, sensitive_features):
+    def __init__(self, predictions, labels, sensitive_features, min_support=0, cache=None, instrumentation=None,
+                 n_jobs=1):
         """
         Inizializza il toolkit con un modello di ML e dati necessari per calcolare privacy e fairness.
         
         :param predictions: Predizioni del modello
         :param labels: Etichette reali
-        :param sensitive_features: Feature sensibili per la fairness (es. genere, etnia)
+        :param sensitive_features: Feature sensibili per la fairness (es. genere, etnia); con più
+                                   colonne le metriche sono calcolate sulle intersezioni dei gruppi
+        :param min_support: Numero minimo di righe perché un gruppo entri nelle metriche di fairness
+        :param cache: ResultCache opzionale per riutilizzare i risultati di audit con input identici
+        :param instrumentation: Instrumentation opzionale che misura tempi, chiamate e memoria di ogni
+                                fase (rumore, conteggi, metriche) per epsilon; viene passata a
+                                DifferentialPrivacy, FairnessMetrics e ModelEvaluator
+        :param n_jobs: numero di processi tra cui suddividere le righe nel calcolo dei conteggi per
+                       metriche e valutazione (None o -1 usa tutti i core)
         """
         self.predictions = predictions
         self.labels = labels
         self.sensitive_features = sensitive_features
+        self.min_support = min_support
+        self.cache = cache
+        self.instrumentation = instrumentation or NULL_INSTRUMENTATION
+        self.n_jobs = n_jobs
+
+    @classmethod
+    def from_dataset(cls, predictions, dataset, min_support=0, cache=None, instrumentation=None, n_jobs=1):
+        """
+        Crea il toolkit per le predizioni di un modello su un EncodedDataset condiviso, così che
+        più modelli valutati sullo stesso test set codifichino gruppi ed etichette una sola volta.
+
+        :param predictions: Predizioni del modello
+        :param dataset: EncodedDataset con etichette e feature sensibili
+        :return: istanza di Toolkit
+        """
+        toolkit = cls(predictions, dataset.labels, dataset.sensitive_features, min_support, cache, instrumentation,
+                      n_jobs)
+        toolkit._dataset = dataset
+        return toolkit
+
+    @classmethod
+    def from_npy(cls, predictions, labels, sensitive_features, min_support=0, cache=None, instrumentation=None,
+                 n_jobs=1):
+        """
+        Crea il toolkit da file .npy aperti in memory-map (es. predizioni ed etichette int8, codici di
+        gruppo uint16): metriche e valutazione lavorano a blocchi sui file, senza copie convertite
+        nei tipi a 64 bit.
+
+        :param predictions: percorso del file .npy (o array) delle predizioni
+        :param labels: percorso del file .npy (o array) delle etichette
+        :param sensitive_features: percorso del file .npy (o array) delle feature sensibili
+        :return: istanza di Toolkit
+        """
+        predictions = Utilities.load_array(predictions)
+        dataset = EncodedDataset(labels, sensitive_features)
+        return cls.from_dataset(predictions, dataset, min_support, cache, instrumentation, n_jobs)
+
+    @property
+    def predictions(self):
+        """Predizioni del modello; assegnarne di nuove invalida la chiave dei dati usata dalla cache."""
+        return self._predictions
+
+    @predictions.setter
+    def predictions(self, values):
+        self._predictions = values
+        self._data_key = None
+
+    @property
+    def labels(self):
+        """
+        Etichette reali; assegnarne di nuove invalida la cache e l'EncodedDataset, che viene
+        ricostruito al primo utilizzo. Le modifiche sul posto di un array non vengono rilevate.
+        """
+        return self._labels
+
+    @labels.setter
+    def labels(self, values):
+        self._labels = values
+        self._data_key = None
+        self._dataset = None
+
+    @property
+    def sensitive_features(self):
+        """Feature sensibili; come per labels, vanno riassegnate per invalidare cache e codifica."""
+        return self._sensitive_features
+
+    @sensitive_features.setter
+    def sensitive_features(self, values):
+        self._sensitive_features = values
+        self._data_key = None
+        self._dataset = None
+
+    @property
+    def dataset(self):
+        """EncodedDataset delle etichette e delle feature sensibili, costruito al primo utilizzo."""
+        if self._dataset is None:
+            self._dataset = EncodedDataset(self.labels, self.sensitive_features)
+        return self._dataset
+
+    def _fairness_metrics(self, predictions=None):
+        """FairnessMetrics per le predizioni date (default: quelle del toolkit) sul dataset codificato."""
+        predictions = self.predictions if predictions is None else predictions
+        return FairnessMetrics.from_dataset(predictions, self.dataset, self.min_support, self.instrumentation,
+                                            self.n_jobs)
+
+    def _model_evaluator(self):
+        return ModelEvaluator.from_dataset(self.dataset, self.predictions, self.instrumentation, self.n_jobs)
 
     # Metodo per applicare la differential privacy a una variabile categorica tramite Laplace
-    def apply_pure_categorical_dp(self, epsilon, delta=0.1):
+    def apply_pure_categorical_dp(self, epsilon, delta=0.1, rng=None, trials=None):
         """Applica privacy differenziale al modello, aggiungendo rumore alle predizioni."""
-        dp = DifferentialPrivacy(epsilon, delta)
-        return dp.add_laplace_categorical_noise(self.predictions)
+        dp = DifferentialPrivacy(epsilon, delta, rng, self.instrumentation)
+        return dp.add_laplace_categorical_noise(self.predictions, trials=trials)
     # Metodo per applicare la differential privacy a una variabile quantitativa tramite Laplace
-    def apply_pure_dp(self, epsilon, delta=0.1):
+    def apply_pure_dp(self, epsilon, delta=0.1, rng=None, trials=None):
         """Applica privacy differenziale al modello, aggiungendo rumore alle predizioni."""
-        dp = DifferentialPrivacy(epsilon, delta)
-        return dp.add_laplace_noise(self.predictions)
+        dp = DifferentialPrivacy(epsilon, delta, rng, self.instrumentation)
+        return dp.add_laplace_noise(self.predictions, trials=trials)
     # Metodo per applicare la delta differential privacy a una variabile categorica tramite Gauss
-    def apply_categorical_delta_dp(self, epsilon, delta=0.1):
+    def apply_categorical_delta_dp(self, epsilon, delta=0.1, rng=None, trials=None):
         """Applica privacy differenziale al modello, aggiungendo rumore alle predizioni."""
-        dp = DifferentialPrivacy(epsilon, delta)
-        return dp.add_gaussian_categorical_noise(self.predictions)
+        dp = DifferentialPrivacy(epsilon, delta, rng, self.instrumentation)
+        return dp.add_gaussian_categorical_noise(self.predictions, trials=trials)
      # Metodo per applicare la delta differential privacy a una variabile quantitativa tramite Gauss
-    def apply_delta_dp(self, epsilon, delta=0.1):
+    def apply_delta_dp(self, epsilon, delta=0.1, rng=None, trials=None):
         """Applica privacy differenziale al modello, aggiungendo rumore alle predizioni."""
-        dp = DifferentialPrivacy(epsilon, delta)
-        return dp.add_gaussian_noise(self.predictions)
+        dp = DifferentialPrivacy(epsilon, delta, rng, self.instrumentation)
+        return dp.add_gaussian_noise(self.predictions, trials=trials)
     
     
         
     
+    def _cached(self, compute, **params):
+        """Restituisce il risultato dalla cache (se configurata) oppure lo calcola con compute()."""
+        if self.cache is None:
+            return compute()
+        if self._data_key is None:
+            self._data_key = make_key(self.predictions, self.labels, self.sensitive_features)
+        key = make_key(data=self._data_key, min_support=self.min_support, **params)
+        return self.cache.get_or_compute(key, compute)
+
+    def _fairness_metrics_results(self):
+        fm = self._fairness_metrics()
+        return {
+            "demographic_parity": fm.compute_statistical_parity(),
+            "equalized_odds": fm.compute_equalized_odds(),
+            "predictive_parity": fm.compute_predictive_parity(),
+            "compute_predictive_value_parity": fm.compute_predictive_value_parity(),
+            "compute_positive_rate_parity": fm.compute_positive_rate_parity(),
+            "compute_false_positive_parity": fm.compute_false_positive_parity(),
+            "compute_equal_opportunity": fm.compute_equal_opportunity(),
+            "compute_well_calibration": fm.compute_well_calibration(),
+            "compute_balance_for_positive_class": fm.compute_balance_for_positive_class(),
+            "compute_balance_for_negative_class": fm.compute_balance_for_negative_class(),
+        }
+
+    def _fairness_accuracy_results(self):
+        em = self._model_evaluator()
+        fm = self._fairness_metrics()
+        return {
+            "accuracy": em.accuracy(),
+            "demographic_parity": fm.compute_statistical_parity(),
+            "predictive_parity": fm.compute_predictive_parity(),
+            "compute_equal_opportunity": fm.compute_equal_opportunity(),
+            "compute_well_calibration": fm.compute_well_calibration(),
+        }
+
      # Metodo per calcolare le metriche di fairness
-    def summary_fairness_metrics(self):
-        fm = FairnessMetrics(self.predictions, self.labels,self.sensitive_features)
-        print("demographic_parity: " + str(fm.compute_statistical_parity()))
-        print("equalized_odds: " + str(fm.compute_equalized_odds()))
-        print("predictive_parity: " + str(fm.compute_predictive_parity()))
-        print("compute_predictive_value_parity: " + str(fm.compute_predictive_value_parity()))
-        print("compute_positive_rate_parity: " + str(fm.compute_positive_rate_parity()))
-        print("compute_false_positive_parity: " + str(fm.compute_false_positive_parity()))
-        print("compute_equal_opportunity: " + str(fm.compute_equal_opportunity()))
-        print("compute_well_calibration: " + str(fm.compute_well_calibration()))
-        print("compute_balance_for_positive_class: " + str(fm.compute_balance_for_positive_class()))
-        print("compute_balance_for_negative_class: " + str(fm.compute_balance_for_negative_class()))
+    @instrumented('toolkit.summary_fairness_metrics')
+    def summary_fairness_metrics(self, verbose=True):
+        results = self._cached(self._fairness_metrics_results, summary="fairness_metrics")
+        if verbose:
+            for name, value in results.items():
+                print(name + ": " + str(value))
+        return results
         
         
-    def summary_evaluation_metrics(self):
-        em = ModelEvaluator(self.labels,self.predictions)
-        print(em.summary())
+    @instrumented('toolkit.summary_evaluation_metrics')
+    def summary_evaluation_metrics(self, verbose=True):
+        summary = self._cached(lambda: self._model_evaluator().summary(),
+                               summary="evaluation_metrics")
+        if verbose:
+            print(summary)
+        return summary
         
 
 
-    def summary_fairness_accuracy(self):
-        em = ModelEvaluator(self.labels,self.predictions)
-        fm = FairnessMetrics(self.predictions, self.labels,self.sensitive_features)
-        print("accuracy: " + str(em.accuracy()))
-        print("demographic_parity: " + str(fm.compute_statistical_parity()))
-        print("predictive_parity: " + str(fm.compute_predictive_parity()))
-        print("compute_equal_opportunity: " + str(fm.compute_equal_opportunity()))
-        print("compute_well_calibration: " + str(fm.compute_well_calibration()))
+    @instrumented('toolkit.summary_fairness_accuracy')
+    def summary_fairness_accuracy(self, verbose=True):
+        results = self._cached(self._fairness_accuracy_results, summary="fairness_accuracy")
+        if verbose:
+            for name, value in results.items():
+                print(name + ": " + str(value))
+        return results
+
+    def summary_fairness_intervals(self, n_resamples=1000, confidence=0.95, seed=None, verbose=True):
+        """
+        Stampa e restituisce gli intervalli di confidenza bootstrap di tutte le metriche di fairness.
+
+        :param n_resamples: numero di ricampionamenti
+        :param confidence: livello di confidenza (default 95%)
+        :param seed: seed per rendere riproducibile il ricampionamento
+        :param verbose: se True stampa gli intervalli
+        :return: dizionario metrica -> stima, deviazione standard e estremi dell'intervallo
+        """
+        def compute():
+            fm = self._fairness_metrics()
+            return fm.bootstrap(n_resamples, confidence, seed=seed)
+
+        if seed is None:
+            intervals = compute()
+        else:
+            intervals = self._cached(compute, summary="fairness_intervals", n_resamples=n_resamples,
+                                     confidence=confidence, seed=seed)
+        if verbose:
+            Utilities.print_dictionary(intervals)
+        return intervals
+        
+        
+    def evaluate_thresholds(self, scores, thresholds=None):
+        """
+        Calcola accuratezza e metriche di fairness per ogni soglia applicata ai punteggi del modello.
+
+        :param scores: punteggi del modello (es. model.predict_proba(X)[:, 1])
+        :param thresholds: soglie da valutare (default: tutti i valori distinti dei punteggi)
+        :return: dizionario con soglie, tassi per gruppo, accuratezza e differenze tra gruppi
+        """
+        fm = self._fairness_metrics()
+        return fm.compute_threshold_curves(scores, thresholds)
         
         
-    def evaluate_tradeoff_accuracy_fairness(self, noise_type, data_type, delta=0.1):
-     """
-     Calcola l'accuratezza e le metriche di fairness per una gamma di valori di epsilon,
-     in modo da valutare il trade-off tra privacy, accuratezza e fairness.
-
-     :param epsilon_values: lista di valori epsilon per la privacy differenziale
-     :param noise_type: tipo di rumore ('laplace' o 'gaussian')
-     :param data_type: tipo di dato ('categorical' o 'quantitative')
-     :param delta: valore delta per la privacy differenziale
-     :return: dizionario contenente accuracy e metriche di fairness per ciascun valore di epsilon
-     """
-     tradeoff_results = {}
-     epsilon_values=[0.1,0.3,0.7,1.5,2,2.5,3,5,7]
-     
-     for epsilon in epsilon_values:
+    def evaluate_calibration(self, scores, n_bins=10, strategy='uniform'):
+        """
+        Calcola la curva di affidabilità e gli errori di calibrazione (ECE, MCE) per ogni gruppo.
+
+        :param scores: probabilità predette della classe positiva
+        :param n_bins: numero di bin
+        :param strategy: 'uniform' oppure 'quantile'
+        :return: dizionario con tabella di affidabilità, ECE e MCE per gruppo
+        """
+        fm = self._fairness_metrics()
+        return fm.compute_calibration_by_group(scores, n_bins, strategy)
+        
+        
+    def apply_noise(self, noise_type, data_type, epsilon, delta=0.1, rng=None, trials=None):
+        """
+        Applica il meccanismo di privacy differenziale scelto alle predizioni.
+
+        :param noise_type: tipo di rumore ('laplace' o 'gaussian')
+        :param data_type: tipo di dato ('categorical' o 'quantitative')
+        :param epsilon: valore epsilon per la privacy differenziale
+        :param delta: valore delta per la privacy differenziale
+        :param rng: seed, SeedSequence o Generator numpy usato per il rumore
+        :param trials: se specificato, genera in blocco `trials` versioni rumorose (array trials x n)
+        :return: predizioni con rumore
+        """
         # Scegliere il metodo appropriato in base a `noise_type` e `data_type`
         if noise_type == 'laplace' and data_type == 'categorical':
-            noisy_predictions = self.apply_pure_categorical_dp(epsilon, delta)
+            return self.apply_pure_categorical_dp(epsilon, delta, rng, trials)
         elif noise_type == 'laplace' and data_type == 'quantitative':
-            noisy_predictions = self.apply_pure_dp(epsilon, delta)
+            return self.apply_pure_dp(epsilon, delta, rng, trials)
         elif noise_type == 'gaussian' and data_type == 'categorical':
-            noisy_predictions = self.apply_categorical_delta_dp(epsilon, delta)
+            return self.apply_categorical_delta_dp(epsilon, delta, rng, trials)
         elif noise_type == 'gaussian' and data_type == 'quantitative':
-            noisy_predictions = self.apply_delta_dp(epsilon, delta)
+            return self.apply_delta_dp(epsilon, delta, rng, trials)
         else:
             raise ValueError("Invalid combination of noise_type and data_type")
-        
-        em = ModelEvaluator(self.labels,noisy_predictions)
-
-        # Calcola le metriche di fairness con FairnessMetrics
-        fairness_evaluator = FairnessMetrics(noisy_predictions, self.labels, self.sensitive_features)
-        demographic_parity = fairness_evaluator.compute_statistical_parity()
-        equal_opportunity= fairness_evaluator.compute_equal_opportunity()
-        well_calibration= fairness_evaluator.compute_well_calibration()
-        accuracy =  em.accuracy()
-        predictive_parity = fairness_evaluator.compute_predictive_parity()
-
-        # Salva i risultati nel dizionario per questo valore di epsilon
-        tradeoff_results[epsilon] = {
-            "accuracy":accuracy,
-            "demographic_parity": demographic_parity,
-            "equal_opportunity": equal_opportunity,
-            "predictive_parity": predictive_parity,
-            "well_calibration": well_calibration
+
+    def tradeoff_metrics(self, noisy_predictions):
+        """
+        Calcola accuratezza e metriche di fairness per una o più versioni rumorose delle predizioni.
+
+        Accuratezza e metriche derivano dallo stesso tensore di confusione per gruppo, quindi
+        un blocco trials x n viene valutato con un unico conteggio vettoriale.
+
+        :param noisy_predictions: predizioni con rumore, shape (n,) oppure (trials, n)
+        :return: dizionario con accuracy e metriche di fairness (array per ogni trial se batch)
+        """
+        return self._tradeoff_summary(self._fairness_metrics(noisy_predictions))
+
+    def _tradeoff_summary(self, fairness_evaluator):
+        """Accuratezza e metriche di fairness dello sweep a partire dai conteggi di un FairnessMetrics."""
+        # Accuratezza binaria (tp + tn) / (tp + fp + fn + tn) sommando i conteggi di tutti i gruppi
+        counts = fairness_evaluator.counts.sum(axis=-3)
+        binary_total = counts[..., :2, :2].sum(axis=(-1, -2))
+        accuracy = np.divide(counts[..., 0, 0] + counts[..., 1, 1], binary_total,
+                             out=np.zeros(binary_total.shape), where=binary_total > 0)
+        return {
+            "accuracy": float(accuracy) if accuracy.ndim == 0 else accuracy,
+            "demographic_parity": fairness_evaluator.compute_statistical_parity(),
+            "equal_opportunity": fairness_evaluator.compute_equal_opportunity(),
+            "predictive_parity": fairness_evaluator.compute_predictive_parity(),
+            "well_calibration": fairness_evaluator.compute_well_calibration()
         }
 
-     Utilities.print_dictionary(tradeoff_results)
-     return tradeoff_results
-    
+    def expected_tradeoff_metrics(self, noise_type, epsilon_values, delta=0.1):
+        """
+        Valori attesi di accuratezza e metriche di fairness sotto rumore categorico, senza campionamento.
+
+        Il meccanismo categorico sostituisce la categoria osservata c con j con probabilità T[c, j],
+        quindi i conteggi attesi per gruppo si ottengono dai conteggi puliti
+        (gruppo x classe dell'etichetta x categoria predetta) moltiplicati per T: dopo un passaggio
+        sui dati, ogni epsilon costa O(G·k²). Le metriche sono calcolate sui conteggi attesi
+        (stima plug-in): l'accuratezza coincide con la media del campionamento, mentre le
+        differenze max-min tra gruppi ne sono l'approssimazione per gruppi numerosi.
+
+        :param noise_type: tipo di rumore ('laplace' o 'gaussian')
+        :param epsilon_values: lista di valori epsilon
+        :param delta: valore delta (non usato dai meccanismi categorici)
+        :return: dizionario metrica -> array con un valore per ciascun epsilon
+        """
+        dataset = self.dataset
+        categories, joint_counts = dataset.category_counts(self.predictions)
+        matrices = np.stack([DifferentialPrivacy(epsilon, delta).categorical_transition_matrix(len(categories),
+                                                                                               noise_type)
+                             for epsilon in epsilon_values])
+        counts, correct, prediction_sums = expected_confusion(joint_counts, dataset.classes, categories, matrices)
+
+        groups, label_sums = dataset.groups, dataset.label_sums
+        if self.min_support > 0:
+            # Come in FairnessMetrics: i gruppi con meno di min_support righe sono esclusi
+            supported = dataset.group_sizes >= self.min_support
+            if not supported.any():
+                raise ValueError("No group reaches the minimum support")
+            groups, counts, correct = groups[supported], counts[..., supported, :, :], correct[..., supported]
+            prediction_sums = None if prediction_sums is None else prediction_sums[..., supported]
+            label_sums = None if label_sums is None else label_sums[supported]
+        fm = FairnessMetrics.from_counts(groups, counts, correct, prediction_sums, label_sums, self.instrumentation)
+        return self._tradeoff_summary(fm)
+
+    def evaluate_tradeoff_point(self, noise_type, data_type, epsilon, delta=0.1, rng=None, n_trials=1,
+                                percentiles=(2.5, 97.5)):
+        """
+        Calcola accuratezza e metriche di fairness per un singolo punto (epsilon, delta).
+
+        Con n_trials > 1 il rumore viene generato a blocchi di trials x n e per ogni metrica si
+        restituiscono media, deviazione standard e percentili sulle ripetizioni.
+
+        :param n_trials: numero di estrazioni di rumore indipendenti
+        :param percentiles: percentili da riportare quando n_trials > 1
+        :return: dizionario con accuracy e metriche di fairness delle predizioni con rumore
+        """
+        if n_trials < 1:
+            raise ValueError("n_trials must be at least 1")
+        samples = self._tradeoff_samples(noise_type, data_type, epsilon, delta, rng, n_trials)
+        return samples if n_trials == 1 else _summarize_trials(samples, percentiles)
+
+    def _tradeoff_samples(self, noise_type, data_type, epsilon, delta, rng, n_trials):
+        """Metriche di ogni ripetizione del rumore: scalari se n_trials == 1, altrimenti array di n_trials valori."""
+        # Le fasi interne (rumore, conteggi, metriche) ereditano i tag epsilon e delta
+        with self.instrumentation.stage('toolkit.tradeoff_point', epsilon=epsilon, delta=delta):
+            if n_trials == 1:
+                return self.tradeoff_metrics(self.apply_noise(noise_type, data_type, epsilon, delta, rng))
+            return self._trial_block_samples(noise_type, data_type, epsilon, delta, rng, n_trials)
+
+    def _trial_block_samples(self, noise_type, data_type, epsilon, delta, rng, n_trials):
+
+        # Tutti i blocchi condividono lo stesso generatore, così le ripetizioni restano indipendenti
+        rng = np.random.default_rng(rng)
+        block_size = max(1, TRIAL_BLOCK_ELEMENTS // max(1, len(self.labels)))
+        samples = {}
+        for start in range(0, n_trials, block_size):
+            trials = min(block_size, n_trials - start)
+            noisy_predictions = self.apply_noise(noise_type, data_type, epsilon, delta, rng, trials)
+            for name, values in self.tradeoff_metrics(noisy_predictions).items():
+                samples.setdefault(name, []).append(values)
+        return {name: np.concatenate(blocks) for name, blocks in samples.items()}
+
+    @instrumented('toolkit.tradeoff_sweep')
+    def evaluate_tradeoff_accuracy_fairness(self, noise_type, data_type, delta=0.1, epsilon_values=None,
+                                            seed=None, n_jobs=1, backend='process', n_trials=1,
+                                            percentiles=(2.5, 97.5), store=None, model_name='',
+                                            dataset_name='', verbose=True, mode='sampled'):
+        """
+        Calcola l'accuratezza e le metriche di fairness per una gamma di valori di epsilon,
+        in modo da valutare il trade-off tra privacy, accuratezza e fairness.
+
+        Ogni punto della griglia riceve un proprio flusso casuale derivato da `seed`
+        (SeedSequence.spawn), quindi i risultati non dipendono dal numero di worker. Con
+        backend='process' le fasi eseguite nei worker non sono misurate dall'instrumentation.
+
+        :param noise_type: tipo di rumore ('laplace' o 'gaussian')
+        :param data_type: tipo di dato ('categorical' o 'quantitative')
+        :param delta: valore delta per la privacy differenziale, oppure lista di valori delta
+        :param epsilon_values: lista di valori epsilon (default: griglia predefinita)
+        :param seed: seed (intero, SeedSequence o Generator) per rendere riproducibile il rumore; con un
+                     Generator i flussi derivano da una sua estrazione e i risultati non vanno in cache
+        :param n_jobs: numero di worker tra cui distribuire i punti della griglia (None o -1 usa tutti
+                       i core); indipendente da Toolkit.n_jobs, che suddivide le righe dei conteggi:
+                       con backend='process' i worker contano sempre in serie
+        :param backend: 'process' oppure 'thread' (non ammesso con Instrumentation(track_memory=True))
+        :param n_trials: numero di ripetizioni del rumore per ogni punto; se > 1 ogni metrica
+                         riporta media, deviazione standard e percentili
+        :param percentiles: percentili riportati quando n_trials > 1
+        :param store: ResultsStore opzionale in cui aggiungere una riga per ogni punto e ripetizione
+                      (chiavi model, dataset, noise_type, data_type, epsilon, delta, trial, seed)
+        :param model_name: nome del modello registrato nello store
+        :param dataset_name: nome del dataset registrato nello store
+        :param verbose: se True stampa i risultati
+        :param mode: 'sampled' genera il rumore; 'analytic' (solo dati categorici) calcola i valori
+                     attesi dalla matrice di transizione (vedi expected_tradeoff_metrics), ignorando
+                     seed, n_trials e worker; nello store le righe analitiche hanno trial = -1
+        :return: dizionario contenente accuracy e metriche di fairness per ciascun valore di epsilon
+                 (per ciascuna coppia (epsilon, delta) se delta è una lista)
+        """
+        if epsilon_values is None:
+            epsilon_values = DEFAULT_EPSILON_VALUES
+        if n_trials < 1:
+            raise ValueError("n_trials must be at least 1")
+        if backend == 'thread' and n_jobs != 1 and getattr(self.instrumentation, 'track_memory', False):
+            # tracemalloc è unico per il processo: i picchi di punti valutati in parallelo si mescolerebbero
+            raise ValueError("Instrumentation(track_memory=True) is not supported with backend='thread'")
+        delta_grid = isinstance(delta, (list, tuple, np.ndarray))
+        delta_values = list(delta) if delta_grid else [delta]
+        grid = [(epsilon, d) for epsilon in epsilon_values for d in delta_values]
+        if mode == 'analytic':
+            return self._analytic_tradeoff(noise_type, data_type, grid, delta_grid, store, model_name,
+                                           dataset_name, verbose)
+        elif mode != 'sampled':
+            raise ValueError("Invalid mode")
+        seeds = _seed_sequence(seed).spawn(len(grid))
+        tasks = [(noise_type, data_type, epsilon, d, child, n_trials) for (epsilon, d), child in zip(grid, seeds)]
+
+        # Senza seed (o con un Generator) il rumore non è riproducibile, quindi il risultato non viene messo in cache
+        if seed is None or isinstance(seed, np.random.Generator):
+            samples = self._run_tradeoff_tasks(tasks, n_jobs, backend)
+        else:
+            samples = self._cached(
+                lambda: self._run_tradeoff_tasks(tasks, n_jobs, backend), sweep="tradeoff_samples",
+                noise_type=noise_type, data_type=data_type,
+                epsilon_values=[float(epsilon) for epsilon in epsilon_values],
+                delta=[float(d) for d in delta_values] if delta_grid else float(delta),
+                seed=seed, n_trials=n_trials)
+
+        if store is not None:
+            # Con un seed le righe sono riproducibili: un nuovo sweep (o un risultato dalla cache) non le duplica
+            self._append_records(store, self._tradeoff_records(grid, samples, noise_type, data_type, n_trials, seed,
+                                                               model_name, dataset_name), _store_seed(seed) != -1)
+
+        # Salva i risultati nel dizionario per ciascun punto della griglia
+        tradeoff_results = {}
+        for (epsilon, d), result in zip(grid, samples):
+            tradeoff_results[(epsilon, d) if delta_grid else epsilon] = (
+                result if n_trials == 1 else _summarize_trials(result, percentiles))
+        if verbose:
+            Utilities.print_dictionary(tradeoff_results)
+        return tradeoff_results
+
+    def _analytic_tradeoff(self, noise_type, data_type, grid, delta_grid, store, model_name, dataset_name, verbose):
+        if data_type != 'categorical':
+            raise ValueError("mode='analytic' requires data_type='categorical'")
+        # Le matrici categoriche non dipendono da delta: un solo calcolo vettoriale per tutti gli epsilon
+        expected = self.expected_tradeoff_metrics(noise_type, [epsilon for epsilon, _ in grid])
+        samples = [{name: float(values[i]) for name, values in expected.items()} for i in range(len(grid))]
+        if store is not None:
+            columns = self._tradeoff_records(grid, samples, noise_type, data_type, 1, None, model_name, dataset_name)
+            columns["trial"][:] = -1
+            self._append_records(store, columns, True)
+
+        tradeoff_results = {(epsilon, d) if delta_grid else epsilon: result for (epsilon, d), result in zip(grid, samples)}
+        if verbose:
+            Utilities.print_dictionary(tradeoff_results)
+        return tradeoff_results
+
+    @instrumented('toolkit.epsilon_search')
+    def search_epsilon(self, noise_type, data_type, min_accuracy=None, max_demographic_parity=None, delta=0.1,
+                       epsilon_range=(0.01, 10.0), tolerance=0.02, seed=None, n_trials=1, mode='sampled'):
+        """
+        Cerca il più piccolo epsilon per cui accuratezza e demographic parity rispettano i vincoli,
+        con bisezioni su log(epsilon) invece di valutare un'intera griglia.
+
+        I vincoli possono andare in direzioni opposte: l'accuratezza cresce con epsilon (meno rumore),
+        mentre con rumore categorico la demographic parity cresce perché il rumore appiattisce i tassi
+        dei gruppi. Per ogni vincolo la direzione si ricava dagli estremi di epsilon_range e la
+        bisezione trova l'intervallo di epsilon che lo rispetta; la risposta è l'estremo inferiore
+        dell'intersezione degli intervalli.
+
+        In modalità 'sampled' tutte le valutazioni usano le stesse estrazioni (common random
+        numbers): uniformi e categorie sostitutive per i dati categorici, rumore standard da
+        riscalare per quelli quantitativi. Le metriche variano così in modo (quasi) monotono con
+        epsilon e ogni passo ricalcola solo le soglie sulle estrazioni esistenti.
+
+        :param noise_type: tipo di rumore ('laplace' o 'gaussian')
+        :param data_type: tipo di dato ('categorical' o 'quantitative')
+        :param min_accuracy: accuratezza minima richiesta (media sulle ripetizioni)
+        :param max_demographic_parity: demographic parity massima ammessa (media sulle ripetizioni)
+        :param delta: valore delta per la privacy differenziale
+        :param epsilon_range: intervallo (minimo, massimo) in cui cercare epsilon
+        :param tolerance: precisione relativa (> 0) su epsilon a cui fermare le bisezioni
+        :param seed: seed delle estrazioni comuni (intero, SeedSequence o Generator)
+        :param n_trials: numero di ripetizioni del rumore valutate per ogni epsilon
+        :param mode: 'sampled' oppure 'analytic' (valori attesi, solo dati categorici)
+        :return: dizionario con epsilon (il più piccolo ammissibile, None se nessuno lo è),
+                 epsilon_max (il più grande ammissibile), feasible, metrics in epsilon ed
+                 evaluations (metriche di ogni epsilon valutato)
+        """
+        if min_accuracy is None and max_demographic_parity is None:
+            raise ValueError("At least one of min_accuracy and max_demographic_parity is required")
+        low, high = epsilon_range
+        if not 0 < low < high:
+            raise ValueError("epsilon_range must satisfy 0 < low < high")
+        if not tolerance > 0:
+            raise ValueError("tolerance must be positive")
+        if n_trials < 1:
+            raise ValueError("n_trials must be at least 1")
+        if mode == 'analytic':
+            if data_type != 'categorical':
+                raise ValueError("mode='analytic' requires data_type='categorical'")
+
+            def metrics_at(epsilon):
+                expected = self.expected_tradeoff_metrics(noise_type, [epsilon], delta)
+                return {name: float(values[0]) for name, values in expected.items()}
+        elif mode == 'sampled':
+            metrics_at = self._coupled_tradeoff(noise_type, data_type, delta, seed, n_trials)
+        else:
+            raise ValueError("Invalid mode")
+
+        evaluations = {}
+
+        def metric(epsilon, name):
+            if epsilon not in evaluations:
+                evaluations[epsilon] = metrics_at(epsilon)
+            return evaluations[epsilon][name]
+
+        def satisfying_interval(satisfied):
+            """Intervallo di epsilon in cui vale un vincolo monotono, None se non vale a nessun estremo."""
+            at_low, at_high = satisfied(low), satisfied(high)
+            if at_low and at_high:
+                return low, high
+            if not (at_low or at_high):
+                return None
+            inside, outside = (low, high) if at_low else (high, low)
+            # Invariante: inside soddisfa il vincolo, outside no
+            while max(inside, outside) / min(inside, outside) > 1 + tolerance:
+                middle = math.sqrt(inside * outside)
+                if satisfied(middle):
+                    inside = middle
+                else:
+                    outside = middle
+            return (low, inside) if at_low else (inside, high)
+
+        intervals = []
+        if min_accuracy is not None:
+            intervals.append(satisfying_interval(lambda epsilon: metric(epsilon, "accuracy") >= min_accuracy))
+        if max_demographic_parity is not None:
+            intervals.append(satisfying_interval(
+                lambda epsilon: metric(epsilon, "demographic_parity") <= max_demographic_parity))
+        feasible = None not in intervals
+        if feasible:
+            # Gli estremi degli intervalli sono tutti punti già valutati
+            lower = max(interval[0] for interval in intervals)
+            upper = min(interval[1] for interval in intervals)
+            feasible = lower <= upper
+        return {
+            "epsilon": lower if feasible else None,
+            "epsilon_max": upper if feasible else None,
+            "feasible": feasible,
+            "metrics": evaluations[lower] if feasible else None,
+            "evaluations": [{"epsilon": e, **evaluations[e]} for e in sorted(evaluations)],
+        }
+
+    def _coupled_tradeoff(self, noise_type, data_type, delta, seed, n_trials):
+        """
+        Prepara le estrazioni di rumore comuni e restituisce la funzione epsilon -> metriche (medie
+        sulle ripetizioni) che le riusa per ogni epsilon.
+
+        Come in _trial_block_samples le ripetizioni sono divise in blocchi di al più
+        TRIAL_BLOCK_ELEMENTS valori; ogni blocco ha un proprio seed e, se i blocchi sono più di
+        uno, le sue estrazioni vengono rigenerate identiche a ogni valutazione invece di restare
+        tutte in memoria.
+        """
+        n = len(self.labels)
+        block_size = max(1, TRIAL_BLOCK_ELEMENTS // max(1, n))
+        blocks = [min(block_size, n_trials - start) for start in range(0, n_trials, block_size)]
+        seeds = _seed_sequence(seed).spawn(len(blocks))
+        if data_type == 'categorical':
+            categories, codes = Utilities.factorize(np.asarray(self.predictions))
+            k = len(categories)
+
+            def draws(child, trials):
+                rng = np.random.default_rng(child)
+                uniforms = rng.random((trials, n))
+                replacements = rng.integers(0, max(k - 1, 1), (trials, n), dtype=np.min_scalar_type(max(k - 2, 0)))
+                return uniforms, replacements
+
+            def noisy_predictions(epsilon, block):
+                dp = DifferentialPrivacy(epsilon, delta, instrumentation=self.instrumentation)
+                matrix = dp.categorical_transition_matrix(k, noise_type)
+                return categories[dp.coupled_categorical_codes(codes, matrix, *block)]
+        elif data_type == 'quantitative':
+            predictions = np.asarray(self.predictions, dtype=float)
+
+            def draws(child, trials):
+                return DifferentialPrivacy(1.0, delta, child).standard_noise(noise_type, (trials, n))
+
+            def noisy_predictions(epsilon, noise):
+                return predictions + DifferentialPrivacy(epsilon, delta).noise_scale(noise_type) * noise
+        else:
+            raise ValueError("Invalid combination of noise_type and data_type")
+
+        # Con un solo blocco le estrazioni restano in memoria tra una valutazione e l'altra
+        resident = draws(seeds[0], blocks[0]) if len(blocks) == 1 else None
+
+        def metrics_at(epsilon):
+            samples = {}
+            with self.instrumentation.stage('toolkit.tradeoff_point', epsilon=epsilon, delta=delta):
+                for child, trials in zip(seeds, blocks):
+                    block = resident if resident is not None else draws(child, trials)
+                    for name, values in self.tradeoff_metrics(noisy_predictions(epsilon, block)).items():
+                        samples.setdefault(name, []).append(np.atleast_1d(values))
+            return {name: float(np.concatenate(values).mean()) for name, values in samples.items()}
+        return metrics_at
+
+    def _tradeoff_records(self, grid, samples, noise_type, data_type, n_trials, seed, model_name, dataset_name):
+        """Converte le metriche di ogni punto e ripetizione in colonne per ResultsStore."""
+        n_rows = len(grid) * n_trials
+        columns = {
+            "model": np.full(n_rows, model_name),
+            "dataset": np.full(n_rows, dataset_name),
+            "noise_type": np.full(n_rows, noise_type),
+            "data_type": np.full(n_rows, data_type),
+            "epsilon": np.repeat([float(epsilon) for epsilon, _ in grid], n_trials),
+            "delta": np.repeat([float(d) for _, d in grid], n_trials),
+            "trial": np.tile(np.arange(n_trials), len(grid)),
+            "seed": np.full(n_rows, _store_seed(seed), dtype=np.int64),
+        }
+        for name in samples[0]:
+            columns[name] = np.concatenate([np.atleast_1d(result[name]) for result in samples]).astype(float)
+        return columns
+
+    def _append_records(self, store, columns, reproducible):
+        """
+        Aggiunge le righe allo store; se sono riproducibili salta quelle le cui KEY_COLUMNS sono già
+        presenti, così che ripetere uno sweep non alteri count e deviazioni standard di aggregate().
+        """
+        if reproducible:
+            fixed = ("model", "dataset", "noise_type", "data_type", "seed")
+            varying = ("epsilon", "delta", "trial")
+            existing = store.read(columns=varying, where={name: columns[name][0] for name in fixed})
+            if existing:
+                seen = set(zip(*(existing[name].tolist() for name in varying)))
+                new = np.array([key not in seen for key in zip(*(columns[name].tolist() for name in varying))],
+                               dtype=bool)
+                columns = {name: values[new] for name, values in columns.items()}
+        if len(columns["trial"]):
+            store.append(columns)
+
+    def _run_tradeoff_tasks(self, tasks, n_jobs, backend):
+        """Valuta i punti della griglia in serie oppure su un pool di thread o processi."""
+        # Import locale: i job di audit brevi che non usano pool non pagano l'avvio di concurrent.futures
+        from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
+        if n_jobs is None or n_jobs < 0:
+            n_jobs = os.cpu_count() or 1
+        n_jobs = min(n_jobs, len(tasks))
+        if n_jobs <= 1:
+            return [self._tradeoff_samples(*task) for task in tasks]
+        elif backend == 'thread':
+            with ThreadPoolExecutor(max_workers=n_jobs) as executor:
+                return list(executor.map(lambda task: self._tradeoff_samples(*task), tasks))
+        elif backend == 'process':
+            with ProcessPoolExecutor(max_workers=n_jobs, initializer=_init_sweep_worker,
+                                     initargs=(self.predictions, self.dataset, self.min_support)) as executor:
+                chunksize = max(1, len(tasks) // (4 * n_jobs))
+                return list(executor.map(_evaluate_in_sweep_worker, tasks, chunksize=chunksize))
+        else:
+            raise ValueError("Invalid backend")
+
+
+# Toolkit condiviso dai processi worker dello sweep, inizializzato una volta per processo
+_sweep_toolkit = None
+
+
+def _init_sweep_worker(predictions, dataset, min_support):
+    global _sweep_toolkit
+    # I punti sono già distribuiti tra processi: i conteggi del worker non vengono suddivisi per righe,
+    # altrimenti ogni worker aprirebbe un proprio pool (n_jobs² processi)
+    _sweep_toolkit = Toolkit.from_dataset(predictions, dataset, min_support, n_jobs=1)
+
+
+def _evaluate_in_sweep_worker(task):
+    return _sweep_toolkit._tradeoff_samples(*task)
+
+
+def _seed_sequence(seed):
+    """SeedSequence da cui derivare i flussi casuali di uno sweep o di una ricerca di epsilon."""
+    if isinstance(seed, np.random.Generator):
+        return np.random.SeedSequence(int(seed.integers(2 ** 63)))
+    if isinstance(seed, np.random.SeedSequence):
+        # Copia senza i figli già generati: lo stesso seed produce sempre gli stessi flussi
+        return np.random.SeedSequence(seed.entropy, spawn_key=seed.spawn_key, pool_size=seed.pool_size)
+    return np.random.SeedSequence(seed)
+
+
+def _store_seed(seed):
+    """Valore della colonna seed di ResultsStore: il seed intero (o l'entropia di una SeedSequence), -1 se assente."""
+    if isinstance(seed, np.random.SeedSequence):
+        seed = seed.entropy
+    if isinstance(seed, (int, np.integer)) and 0 <= seed < 2 ** 63:
+        return int(seed)
+    return -1
+
+
+def _summarize_trials(samples, percentiles):
+    """Media, deviazione standard e percentili di ogni metrica sulle ripetizioni del rumore."""
+    summary = {}
+    for name, values in samples.items():
+        summary[name] = {"mean": float(values.mean()), "std": float(values.std(ddof=1))}
+        for q, value in zip(percentiles, np.percentile(values, percentiles)):
+            summary[name][f"p{q:g}"] = float(value)
+    return summary
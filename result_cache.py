@@ -0,0 +1,154 @@
+import copy
+import hashlib
+import os
+import pickle
+import threading
+from collections import OrderedDict
+import numpy as np
+
+
+def _update_with_array(digest, values):
+    """Aggiunge al digest il contenuto di un array (o di una tabella colonna per colonna)."""
+    if hasattr(values, 'columns'):
+        digest.update(repr(list(values.columns)).encode())
+        for column in values.columns:
+            _update_with_array(digest, values[column])
+        return
+    values = np.asarray(values)
+    digest.update(f"{values.dtype.str}{values.shape}".encode())
+    if values.dtype.hasobject:
+        digest.update(pickle.dumps(values.tolist(), protocol=pickle.HIGHEST_PROTOCOL))
+    else:
+        digest.update(memoryview(np.ascontiguousarray(values)).cast('B'))
+
+
+def make_key(*arrays, **params):
+    """
+    Calcola una chiave di cache dal contenuto degli array e dai parametri.
+
+    :param arrays: array di input (liste, array numpy, pandas Series o DataFrame)
+    :param params: parametri che influenzano il risultato (metrica, epsilon, delta, seed, ...)
+    :return: stringa esadecimale
+    """
+    digest = hashlib.blake2b(digest_size=20)
+    for values in arrays:
+        _update_with_array(digest, values)
+    digest.update(repr(sorted(params.items())).encode())
+    return digest.hexdigest()
+
+
+class ResultCache:
+    def __init__(self, maxsize=128, directory=None, max_bytes=256 * 1024 ** 2):
+        """
+        Cache dei risultati a due livelli: LRU in memoria e, opzionalmente, su disco.
+
+        :param maxsize: numero massimo di risultati tenuti in memoria
+        :param directory: cartella per il livello su disco (None per usare solo la memoria)
+        :param max_bytes: dimensione massima del livello su disco; oltre questa soglia vengono
+                          eliminati i risultati usati meno di recente
+        """
+        self.maxsize = maxsize
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self._memory = OrderedDict()
+        # Protegge l'LRU in memoria e i contatori quando la cache è condivisa tra thread
+        self._lock = threading.RLock()
+        self.hits = 0
+        self.misses = 0
+        if directory is not None:
+            os.makedirs(directory, exist_ok=True)
+
+    def _path(self, key):
+        return os.path.join(self.directory, key + '.pkl')
+
+    def _remember(self, key, value):
+        with self._lock:
+            self._memory[key] = value
+            self._memory.move_to_end(key)
+            while len(self._memory) > self.maxsize:
+                self._memory.popitem(last=False)
+
+    def get(self, key, default=None):
+        """Restituisce il risultato associato alla chiave, oppure default se assente."""
+        with self._lock:
+            found = key in self._memory
+            if found:
+                self._memory.move_to_end(key)
+                value = self._memory[key]
+                self.hits += 1
+        if found:
+            return copy.deepcopy(value)
+        if self.directory is not None:
+            path = self._path(key)
+            try:
+                with open(path, 'rb') as f:
+                    value = pickle.load(f)
+            except (OSError, EOFError, pickle.UnpicklingError):
+                pass
+            else:
+                try:
+                    # Aggiorna la data di accesso per l'evizione LRU su disco
+                    os.utime(path)
+                except FileNotFoundError:
+                    # Un altro processo ha appena eliminato la voce: il valore letto resta valido
+                    pass
+                self._remember(key, value)
+                with self._lock:
+                    self.hits += 1
+                return copy.deepcopy(value)
+        with self._lock:
+            self.misses += 1
+        return default
+
+    def set(self, key, value):
+        """Memorizza un risultato in memoria e, se configurato, su disco."""
+        self._remember(key, copy.deepcopy(value))
+        if self.directory is not None:
+            path = self._path(key)
+            # Nome temporaneo unico per processo e thread, così che scritture concorrenti non si sovrappongano
+            temporary = f"{path}.{os.getpid()}-{threading.get_ident()}.tmp"
+            with open(temporary, 'wb') as f:
+                pickle.dump(value, f, protocol=pickle.HIGHEST_PROTOCOL)
+            os.replace(temporary, path)
+            self._evict()
+
+    def get_or_compute(self, key, compute):
+        """Restituisce il risultato in cache oppure lo calcola con compute() e lo memorizza."""
+        missing = object()
+        value = self.get(key, missing)
+        if value is missing:
+            value = compute()
+            self.set(key, value)
+        return value
+
+    def _evict(self):
+        entries = []
+        for name in os.listdir(self.directory):
+            if name.endswith('.pkl'):
+                try:
+                    stat = os.stat(os.path.join(self.directory, name))
+                except FileNotFoundError:
+                    # Eliminata nel frattempo da un altro processo
+                    continue
+                entries.append((stat.st_mtime, stat.st_size, name))
+        total = sum(size for _, size, _ in entries)
+        for _, size, name in sorted(entries):
+            if total <= self.max_bytes:
+                break
+            try:
+                os.remove(os.path.join(self.directory, name))
+            except FileNotFoundError:
+                pass
+            total -= size
+
+    def clear(self):
+        """Svuota entrambi i livelli della cache."""
+        with self._lock:
+            self._memory.clear()
+        if self.directory is not None:
+            for name in os.listdir(self.directory):
+                if name.endswith('.pkl'):
+                    try:
+                        os.remove(os.path.join(self.directory, name))
+                    except FileNotFoundError:
+                        pass
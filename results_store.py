@@ -0,0 +1,140 @@
+import importlib.util
+import os
+import time
+import numpy as np
+from utilities import Utilities
+
+# Colonne che identificano un risultato di uno sweep
+KEY_COLUMNS = ("model", "dataset", "noise_type", "data_type", "epsilon", "delta", "trial", "seed")
+
+
+def _pyarrow():
+    """Importa pyarrow solo quando si leggono o scrivono parti Parquet."""
+    try:
+        import pyarrow
+        import pyarrow.parquet
+    except ImportError:
+        raise ImportError("Parquet parts require pyarrow") from None
+    return pyarrow
+
+
+def _column(values):
+    """Converte una colonna in array numpy senza oggetti Python, così da poterla mappare in memoria."""
+    values = np.asarray(values)
+    if values.dtype == object:
+        values = values.astype(str)
+    return values
+
+
+class ResultsStore:
+    def __init__(self, directory, format='npy'):
+        """
+        Archivio colonnare append-only dei risultati degli sweep.
+
+        Ogni append() scrive una nuova parte (una cartella con un file .npy per colonna, oppure un
+        file Parquet se pyarrow è installato e format='parquet') senza riscrivere le precedenti; in
+        lettura le colonne .npy sono mappate in memoria e filtrate parte per parte.
+
+        :param directory: cartella dell'archivio
+        :param format: 'npy' oppure 'parquet'
+        """
+        if format not in ('npy', 'parquet'):
+            raise ValueError("Invalid format")
+        if format == 'parquet' and importlib.util.find_spec('pyarrow') is None:
+            raise ImportError("format='parquet' requires pyarrow")
+        self.directory = directory
+        self.format = format
+        os.makedirs(directory, exist_ok=True)
+
+    def parts(self):
+        """Restituisce i nomi delle parti in ordine di scrittura."""
+        return sorted(name for name in os.listdir(self.directory) if name.startswith('part-')
+                      and not name.endswith('.tmp'))
+
+    def append(self, columns):
+        """
+        Aggiunge un blocco di righe all'archivio.
+
+        :param columns: dizionario colonna -> valori, tutte della stessa lunghezza
+        :return: nome della parte scritta
+        """
+        columns = {name: _column(values) for name, values in columns.items()}
+        lengths = {len(values) for values in columns.values()}
+        if len(lengths) != 1:
+            raise ValueError("All columns must have the same length")
+
+        name = f"part-{time.time_ns():020d}-{os.getpid()}"
+        temporary = os.path.join(self.directory, name + '.tmp')
+        if self.format == 'parquet':
+            name += '.parquet'
+            pyarrow = _pyarrow()
+            table = pyarrow.table({column: pyarrow.array(values) for column, values in columns.items()})
+            pyarrow.parquet.write_table(table, temporary)
+        else:
+            os.makedirs(temporary)
+            for column, values in columns.items():
+                np.save(os.path.join(temporary, column + '.npy'), values)
+        # La parte diventa visibile ai lettori solo quando è completa
+        os.replace(temporary, os.path.join(self.directory, name))
+        return name
+
+    def _read_part(self, name, columns):
+        path = os.path.join(self.directory, name)
+        if name.endswith('.parquet'):
+            table = _pyarrow().parquet.read_table(path, columns=columns, memory_map=True)
+            return {column: table.column(column).to_numpy() for column in table.column_names}
+        if columns is None:
+            columns = [file[:-4] for file in sorted(os.listdir(path)) if file.endswith('.npy')]
+        return {column: np.load(os.path.join(path, column + '.npy'), mmap_mode='r') for column in columns}
+
+    def read(self, columns=None, where=None):
+        """
+        Legge l'archivio, copiando in memoria solo le righe selezionate.
+
+        :param columns: colonne da restituire (default: tutte)
+        :param where: dizionario colonna -> valore o lista di valori ammessi
+        :return: dizionario colonna -> array
+        """
+        where = where or {}
+        needed = None if columns is None else list(dict.fromkeys(list(columns) + list(where)))
+        blocks = {}
+        for name in self.parts():
+            part = self._read_part(name, needed)
+            mask = None
+            for column, allowed in where.items():
+                selected = np.isin(part[column], np.atleast_1d(allowed))
+                mask = selected if mask is None else mask & selected
+            for column in (columns if columns is not None else part):
+                values = part[column]
+                blocks.setdefault(column, []).append(np.asarray(values if mask is None else values[mask]))
+        return {column: np.concatenate(values) for column, values in blocks.items()}
+
+    def aggregate(self, by=("model", "dataset", "noise_type", "epsilon", "delta"), columns=None, where=None):
+        """
+        Media e deviazione standard delle metriche per combinazione delle colonne `by`.
+
+        :param by: colonne di raggruppamento
+        :param columns: colonne numeriche da aggregare (default: tutte quelle non di chiave)
+        :param where: filtro come in read()
+        :return: lista di dizionari, uno per gruppo, con count e <colonna>_mean / <colonna>_std
+        """
+        data = self.read(where=where)
+        if not data:
+            return []
+        if columns is None:
+            columns = [column for column in data if column not in KEY_COLUMNS
+                       and np.issubdtype(data[column].dtype, np.number)]
+        groups, codes = Utilities.factorize_groups(np.column_stack([data[column].astype(object) for column in by]))
+        counts = np.bincount(codes, minlength=len(groups))
+        if len(by) == 1:
+            groups = [(Utilities.convert_to_native(group),) for group in groups]
+        summary = [{"count": int(count), **dict(zip(by, group))} for group, count in zip(groups, counts)]
+        for column in columns:
+            values = data[column].astype(float)
+            means = np.bincount(codes, weights=values, minlength=len(groups)) / counts
+            squares = np.bincount(codes, weights=(values - means[codes]) ** 2, minlength=len(groups))
+            stds = np.sqrt(squares / np.maximum(counts - 1, 1))
+            for row, mean, std in zip(summary, means, stds):
+                row[column + "_mean"] = float(mean)
+                row[column + "_std"] = float(std)
+        return summary
@@ -1,42 +1,21 @@
-import pandas as pd
-from sklearn.model_selection import train_test_split
-from sklearn.preprocessing import LabelEncoder, StandardScaler
 from sklearn.tree import DecisionTreeClassifier
 from sklearn.linear_model import LogisticRegression
 from sklearn.ensemble import RandomForestClassifier
 from xgboost import XGBClassifier
+from dataset_loader import load_dataset
 from privacy_fairness_toolkit import Toolkit
 
-# Load COMPAS dataset
-compas_data = pd.read_csv('compas-scores-raw.csv')
-
-# Selecting relevant columns
-compas_data_relevant = compas_data[['Sex_Code_Text', 'Ethnic_Code_Text', 'DecileScore', 'ScoreText', 'AssessmentType', 'RawScore']]
-compas_data_relevant = compas_data_relevant.dropna()
-
-# Define sensitive features
-sensitive_features = ['Ethnic_Code_Text']
-
-# Define target variable
+# Load COMPAS dataset: relevant columns, label-encoded target, one-hot encoded and scaled features
+# (from the cache if already preprocessed)
 target = 'ScoreText'
-compas_data_relevant[target] = LabelEncoder().fit_transform(compas_data_relevant[target])
-
-# Define features and encode categorical variables
-X = compas_data_relevant.drop(columns=[target] + sensitive_features)
-y = compas_data_relevant[target]
-X = pd.get_dummies(X, drop_first=True)
-X = StandardScaler().fit_transform(X)
-
-sensitive_features_data = compas_data_relevant[sensitive_features]
-
-# Dividi il dataset includendo le feature sensibili
-X_train, X_test, y_train, y_test, sensitive_train, sensitive_test = train_test_split(
-    X, y, sensitive_features_data, test_size=0.2, random_state=42
-)
-
-sensitive_feature = sensitive_test['Ethnic_Code_Text'].values
+sensitive_features = ['Ethnic_Code_Text']
+data = load_dataset('compas-scores-raw.csv', target, sensitive_features,
+                    columns=['Sex_Code_Text', 'Ethnic_Code_Text', 'DecileScore', 'ScoreText', 'AssessmentType',
+                             'RawScore'],
+                    dummies='features', label_encode_target=True, test_size=0.2, random_state=42)
+X_train, X_test, y_train, y_test = data["X_train"], data["X_test"], data["y_train"], data["y_test"]
 
-# Reset degli indici per allinearli
+sensitive_feature = data["sensitive_test"][:, 0]
 
 
 # Define models
@@ -52,8 +31,6 @@ models = {
 for model_name, model in models.items():
     model.fit(X_train, y_train)
     predictions = model.predict(X_test)
-    y_test = y_test.reset_index(drop=True)
-    predictions = pd.Series(predictions).reset_index(drop=True)
     # Initialize toolkit with predictions, labels, and sensitive features
     toolkit = Toolkit(predictions,y_test, sensitive_feature)
     print(model_name)
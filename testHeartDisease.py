@@ -1,32 +1,19 @@
-import pandas as pd
-from sklearn.model_selection import train_test_split
-from sklearn.preprocessing import StandardScaler
 from sklearn.linear_model import LogisticRegression
 from sklearn.ensemble import RandomForestClassifier
 from sklearn.tree import DecisionTreeClassifier
 from xgboost import XGBClassifier
+from dataset_loader import load_dataset
 from privacy_fairness_toolkit import Toolkit
 
-# Caricamento del dataset Adult Census
-heart_data = pd.read_csv('heart.csv')
-
-# Pre-elaborazione dei dati: rimuove righe con valori mancanti
-heart_data = heart_data.dropna()
-
-# Definizione della variabile target e delle feature sensibili
+# Caricamento del dataset Heart Disease: rimuove righe con valori mancanti, standardizza le
+# feature e divide il dataset (dalla cache se già elaborato)
 target = 'target'
 sensitive_features = ['sex']
-y = heart_data[target]
-X = heart_data.drop(columns=[target] + sensitive_features)
-X = StandardScaler().fit_transform(X)  # Standardizzazione delle feature
-
-# Divisione del dataset
-X_train, X_test, y_train, y_test, sensitive_train, sensitive_test = train_test_split(
-    X, y, heart_data[sensitive_features], test_size=0.2, random_state=42
-)
+data = load_dataset('heart.csv', target, sensitive_features, test_size=0.2, random_state=42)
+X_train, X_test, y_train, y_test = data["X_train"], data["X_test"], data["y_train"], data["y_test"]
 
 # Feature sensibile per il test set
-sensitive_feature = sensitive_test['sex'].values
+sensitive_feature = data["sensitive_test"][:, 0]
 
 # Definizione dei modelli
 models = {
@@ -40,10 +27,8 @@ models = {
 for model_name, model in models.items():
     model.fit(X_train, y_train)
     predictions = model.predict(X_test)
-    y_test = y_test.reset_index(drop=True)
-    predictions = pd.Series(predictions).reset_index(drop=True)
     # Inizializzazione del toolkit con predizioni, etichette e feature sensibile
-    toolkit = Toolkit(predictions, y_test.reset_index(drop=True), sensitive_feature)
+    toolkit = Toolkit(predictions, y_test, sensitive_feature)
     
     print(model_name)
     print("modello senza privacy:")
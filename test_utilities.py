@@ -0,0 +1,14 @@
+import numpy as np
+import utilities
+from utilities import Utilities
+
+
+def test_blocked_bincount_grows_in_early_block(monkeypatch):
+    # Un valore >= minlength nel primo blocco allunga il risultato; i blocchi successivi sono più corti
+    monkeypatch.setattr(utilities, "BLOCK_SIZE", 2)
+    values = np.array([7, 0, 1, 1, 0, 1])
+    weights = np.arange(6, dtype=float)
+    np.testing.assert_array_equal(Utilities.blocked_bincount(values, minlength=2), np.bincount(values, minlength=2))
+    np.testing.assert_array_equal(Utilities.blocked_bincount(values, weights, minlength=2),
+                                  np.bincount(values, weights, minlength=2))
+    np.testing.assert_array_equal(Utilities.blocked_bincount(values + 3, offset=3), np.bincount(values))
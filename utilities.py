@@ -1,4 +1,10 @@
+import os
 import numpy as np
+
+# Numero di righe elaborate per blocco sugli array di grandi dimensioni (anche memory-mapped)
+BLOCK_SIZE = 1 << 20
+
+
 class Utilities:
     
 
@@ -44,4 +50,150 @@ class Utilities:
             for sub_key, sub_value in value.items():
                 print(f"  {sub_key}: {sub_value}")
         else:
-            print(f"{key}: {value}")
\ No newline at end of file
+            print(f"{key}: {value}")
+
+  def factorize(values):
+    """
+    Codifica un vettore di valori in codici interi consecutivi.
+
+    I valori unici vengono ordinati quando possibile; se i valori non sono confrontabili
+    (es. tipi misti in un array object) si usa l'ordine di prima apparizione.
+
+    :param values: sequenza di valori (lista, array numpy, pandas Series)
+    :return: tupla (uniques, codes) dove uniques[codes] ricostruisce i valori originali
+    """
+    values = np.asarray(values)
+    if values.ndim != 1:
+        values = values.reshape(-1)
+    if values.dtype.kind in 'iu' and values.size > 0:
+        low, high = int(values.min()), int(values.max())
+        if high - low < BLOCK_SIZE:
+            # Interi in un intervallo ridotto: conteggio a blocchi invece dell'ordinamento,
+            # con codici nel tipo intero più piccolo sufficiente
+            present = Utilities.blocked_bincount(values, offset=low, minlength=high - low + 1) > 0
+            uniques = (np.flatnonzero(present) + low).astype(values.dtype)
+            lookup = (np.cumsum(present) - 1).astype(np.min_scalar_type(len(uniques)))
+            codes = np.empty(len(values), dtype=lookup.dtype)
+            for block in Utilities.row_blocks(len(values)):
+                codes[block] = lookup[values[block].astype(np.intp) - low]
+            return uniques, codes
+    try:
+        uniques, codes = np.unique(values, return_inverse=True)
+    except TypeError:
+        # Valori non ordinabili: codifica tramite dizionario in ordine di apparizione
+        mapping = {}
+        codes = np.fromiter((mapping.setdefault(v, len(mapping)) for v in values.tolist()),
+                            dtype=np.intp, count=len(values))
+        uniques = np.empty(len(mapping), dtype=object)
+        uniques[:] = list(mapping)
+    return uniques, codes.reshape(-1)
+
+
+  def factorize_groups(sensitive_features):
+    """
+    Codifica una o più feature sensibili in codici di gruppo interi.
+
+    Con una sola feature equivale a factorize. Con più feature (DataFrame, array n x m o lista
+    di tuple) i gruppi sono le intersezioni delle feature: i codici di ciascuna colonna vengono
+    combinati in una chiave intera e vengono creati solo i gruppi effettivamente osservati.
+
+    :param sensitive_features: vettore di valori oppure tabella n x m di feature sensibili
+    :return: tupla (groups, codes); con più feature ogni gruppo è una tupla di valori
+    """
+    if hasattr(sensitive_features, 'columns'):
+        columns = [sensitive_features[column].to_numpy() for column in sensitive_features.columns]
+    else:
+        values = np.asarray(sensitive_features)
+        if values.ndim != 2:
+            return Utilities.factorize(values)
+        if not isinstance(sensitive_features, np.ndarray):
+            # Sequenze di tuple: conserva il tipo originale di ciascuna colonna
+            values = np.asarray(sensitive_features, dtype=object)
+        columns = list(values.T)
+    if len(columns) == 1:
+        return Utilities.factorize(columns[0])
+
+    column_uniques, keys, capacity = [], 0, 1
+    for column in columns:
+        uniques, codes = Utilities.factorize(column)
+        column_uniques.append(uniques)
+        capacity *= max(len(uniques), 1)
+        if capacity >= 2 ** 62:
+            raise ValueError("Too many combinations of sensitive features to encode")
+        # Chiave a radice mista: ogni colonna occupa un "digit" di base pari alle sue categorie
+        keys = keys * len(uniques) + codes.astype(np.int64)
+    observed_keys, codes = np.unique(keys, return_inverse=True)
+
+    # Decodifica solo le combinazioni osservate nelle tuple di valori originali
+    digits = []
+    for uniques in reversed(column_uniques):
+        digits.append(uniques[observed_keys % len(uniques)])
+        observed_keys = observed_keys // len(uniques)
+    groups = np.empty(len(digits[0]), dtype=object)
+    groups[:] = [tuple(Utilities.convert_to_native(value) for value in combination)
+                 for combination in zip(*reversed(digits))]
+    return groups, codes.reshape(-1)
+
+
+  def safe_divide(numerator, denominator):
+    """
+    Divisione elemento per elemento che restituisce 0 dove il denominatore è nullo.
+
+    :param numerator: numeratore (scalare o array)
+    :param denominator: denominatore (scalare o array, con shape compatibile)
+    :return: array float con il risultato della divisione
+    """
+    numerator, denominator = np.broadcast_arrays(np.asarray(numerator, dtype=float),
+                                                 np.asarray(denominator, dtype=float))
+    return np.divide(numerator, denominator, out=np.zeros(numerator.shape), where=denominator > 0)
+
+
+  def load_array(source, mmap_mode='r'):
+    """
+    Apre un file .npy in memory-map senza caricarlo in memoria; gli altri valori sono restituiti invariati.
+
+    :param source: percorso di un file .npy, oppure array/lista/pandas Series già in memoria
+    :param mmap_mode: modalità di np.load (default 'r', sola lettura)
+    :return: array memory-mapped oppure source
+    """
+    if isinstance(source, (str, os.PathLike)):
+        return np.load(source, mmap_mode=mmap_mode)
+    return source
+
+
+  def row_blocks(n, block_size=None):
+    """
+    Suddivide n righe in intervalli consecutivi di al più block_size righe.
+
+    :param n: numero di righe
+    :param block_size: righe per blocco (default BLOCK_SIZE)
+    :return: generatore di slice
+    """
+    block_size = block_size or BLOCK_SIZE
+    for start in range(0, n, block_size):
+        yield slice(start, min(start + block_size, n))
+
+
+  def blocked_bincount(values, weights=None, offset=0, minlength=0):
+    """
+    Equivale a np.bincount(values - offset, weights, minlength) ma elabora l'array a blocchi,
+    così che i valori compatti (o memory-mapped) siano convertiti in interi a 64 bit un blocco alla volta.
+
+    :param values: array di interi non negativi (dopo la sottrazione di offset)
+    :param weights: pesi opzionali, stessa lunghezza di values
+    :param offset: valore sottratto a ogni elemento
+    :param minlength: lunghezza minima del risultato
+    :return: array dei conteggi (float se weights è specificato)
+    """
+    total = np.zeros(minlength, dtype=np.int64 if weights is None else float)
+    for block in Utilities.row_blocks(len(values)):
+        chunk = values[block].astype(np.intp) - offset
+        # Ogni blocco copre almeno i valori già contati, così i conteggi si possono sempre sommare
+        counts = np.bincount(chunk, None if weights is None else np.asarray(weights[block], dtype=float),
+                             minlength=len(total))
+        if len(counts) > len(total):
+            counts[:len(total)] += total
+            total = counts
+        else:
+            total += counts
+    return total